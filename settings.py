@@ -13,6 +13,16 @@ class Settings(BaseSettings):
 
     REDIS_HOST: str = Field("", env="REDIS_HOST")
     REDIS_PORT: str = Field("", env="REDIS_PORT")
+    CACHE_BACKEND: str = Field("redis", env="CACHE_BACKEND")
+    CACHE_SQLITE_PATH: str = Field(".cache/cache.sqlite3", env="CACHE_SQLITE_PATH")
+    CACHE_SQLITE_MAX_MB: int = Field(1024, env="CACHE_SQLITE_MAX_MB")
+    CACHE_LOCAL_MAX_ENTRIES: int = Field(1024, env="CACHE_LOCAL_MAX_ENTRIES")
+    CACHE_LOCAL_MAX_MB: int = Field(256, env="CACHE_LOCAL_MAX_MB")
+    CACHE_LOCAL_TTL: int = Field(3600, env="CACHE_LOCAL_TTL")
+    CACHE_COMPRESSION: str = Field("zstd", env="CACHE_COMPRESSION")
+    CACHE_LOCK_LEASE: int = Field(60, env="CACHE_LOCK_LEASE")
+    CACHE_LOCK_WAIT: int = Field(1800, env="CACHE_LOCK_WAIT")
+    CACHE_POSTINGS_SHARDS: int = Field(16, env="CACHE_POSTINGS_SHARDS")
 
     GOOGLE_SPREADSHEET_ID: str = Field("", env="GOOGLE_SPREADSHEET_ID")
     GOOGLE_CLIENT_SECRET: str = Field("", env="GOOGLE_CLIENT_SECRET")
@@ -32,9 +42,18 @@ class Settings(BaseSettings):
     OZON_FBS_POSTINGS_REPORT_URL: str = Field("", env="OZON_FBS_POSTINGS_REPORT_URL")
     OZON_FBO_POSTINGS_REPORT_URL: str = Field("", env="OZON_FBO_POSTINGS_REPORT_URL")
     OZON_ANALYTICS_URL: str = Field("", env="OZON_ANALYTICS_URL")
+    OZON_POSTINGS_REPORT_CREATE_URL: str = Field("/v1/report/postings/create", env="OZON_POSTINGS_REPORT_CREATE_URL")
+    OZON_REPORT_INFO_URL: str = Field("/v1/report/info", env="OZON_REPORT_INFO_URL")
     ANALYTICS_MONTHS: str = Field("", env="ANALYTICS_MONTHS")
+    ANALYTICS_CLOSED_MONTH_TTL_DAYS: int = Field(90, env="ANALYTICS_CLOSED_MONTH_TTL_DAYS")
     DATE_SINCE: str = Field("", env="DATE_SINCE")
     DATE_TO: str = Field("", env="DATE_TO")
+    OZON_POSTINGS_PREFETCH: int = Field(4, env="OZON_POSTINGS_PREFETCH")
+    OZON_POSTINGS_SHARD_DAYS: int = Field(0, env="OZON_POSTINGS_SHARD_DAYS")
+    OZON_POSTINGS_MUTABLE_DAYS: int = Field(14, env="OZON_POSTINGS_MUTABLE_DAYS")
+    OZON_POSTINGS_CLOSED_DAY_TTL_DAYS: int = Field(30, env="OZON_POSTINGS_CLOSED_DAY_TTL_DAYS")
+    OZON_POSTINGS_SOURCE: str = Field("list", env="OZON_POSTINGS_SOURCE")
+    OZON_POSTINGS_STREAMING_AGGREGATION: bool = Field(False, env="OZON_POSTINGS_STREAMING_AGGREGATION")
 
     ONEC_HOST: str = Field("", env="ONEC_HOST")
     ONEC_ENDPOINTS: str = Field("", env="ONEC_ENDPOINTS")
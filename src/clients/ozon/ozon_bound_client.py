@@ -1,5 +1,5 @@
 import logging
-from typing import Optional
+from typing import Optional, Callable, Awaitable
 
 from src.clients.ozon.ozon_client import OzonClient
 from src.schemas.ozon_schemas import AnalyticsRequestSchema, Datum
@@ -15,23 +15,48 @@ class OzonCliBound:
     async def request(self, method: str, endpoint: str, *, json: Optional[dict]=None):
         return await self._base.request(method, endpoint, json=json, headers=self._headers)
 
-    async def fetch_remainders(self, skus: list[str], headers: Optional[dict]=None):
-        return await self._base.fetch_remainders(skus, headers=self._headers or headers)
+    async def fetch_remainders(self, skus: list[str],
+                               headers: Optional[dict]=None,
+                               *,
+                               fan_out: Optional[int] = None,
+                               consumer: Optional[Callable[[list], Awaitable[None]]] = None):
+        return await self._base.fetch_remainders(skus,
+                                                 headers=self._headers or headers,
+                                                 fan_out=fan_out,
+                                                 consumer=consumer)
 
     async def generate_reports(self, delivery_way: str,
                                since: str,
                                to: str, *,
                                limit: int = 1000,
+                               prefetch: int = 1,
+                               changed_since: Optional[str] = None,
+                               changed_to: Optional[str] = None,
                                headers: Optional[dict]=None):
         async for chunk in self._base.generate_reports(delivery_way,
                                                        since,
                                                        to,
                                                        limit=limit,
+                                                       prefetch=prefetch,
+                                                       changed_since=changed_since,
+                                                       changed_to=changed_to,
                                                        headers=self._headers or headers):
             yield chunk
 
-    async def get_skus(self, *, headers: Optional[dict]=None)-> list:
-        return await self._base.get_skus(headers=self._headers or headers)
+    async def export_postings(self, delivery_way: str,
+                              since: str,
+                              to: str, *,
+                              limit: int = 1000,
+                              headers: Optional[dict]=None):
+        async for chunk in self._base.export_postings(delivery_way,
+                                                      since,
+                                                      to,
+                                                      limit=limit,
+                                                      headers=self._headers or headers):
+            yield chunk
+
+    async def get_skus(self, *, headers: Optional[dict]=None, lean: bool = True)-> list:
+        return await self._base.get_skus(headers=self._headers or headers, lean=lean)
 
     async def receive_analytics_data(self, analyt_body: AnalyticsRequestSchema, headers: Optional[dict] = None) \
             -> list[Datum]:
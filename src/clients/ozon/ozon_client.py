@@ -1,5 +1,10 @@
 import asyncio
+import csv
+import io
 import logging
+import tempfile
+from collections import deque
+from datetime import datetime, timedelta, timezone
 from typing import Dict, Optional, Any, ClassVar, Callable, Awaitable
 
 from more_itertools import chunked
@@ -7,8 +12,12 @@ from pydantic import PrivateAttr, ValidationError
 
 from src.schemas.ozon_schemas import (APIError, PostingRequestSchema, StatusDelivery,
                                       FilterPosting, AnalyticsRequestSchema, AnalyticsResponseSchema,
-                                      Datum, ArticlesResponseShema)
+                                      Datum, ArticlesResponseShema, LastChangedStatusDate, ProductInfoLean,
+                                      ProductsInfoLeanResponse, LeanFboPostingResponse,
+                                      LeanFbsPostingResponse)
 from src.schemas.ozon_schemas import FilterProducts, SkusRequestShema
+from src.schemas.ozon_schemas import (PostingsReportFilter, PostingsReportRequestSchema, ReportCreateResponse,
+                                      ReportInfoResponse)
 from src.utils.http_base_client import BaseRateLimitedHttpClient
 from src.utils.limiter import RateLimiter, parse_retry_after_seconds
 
@@ -17,6 +26,9 @@ import httpx
 
 log = logging.getLogger("ozon client")
 
+# время в отчетах Ozon московское; с 2014 года в Москве UTC+3 без перехода на летнее время
+MSK = timezone(timedelta(hours=3), "MSK")
+
 class OzonClient(BaseRateLimitedHttpClient):
     base_url: str
     fbs_reports_url: str
@@ -25,9 +37,43 @@ class OzonClient(BaseRateLimitedHttpClient):
     products_url: str
     products_whole_info_url: str
     analytics_url: str
+    partition_header: Optional[str] = "Client-Id"  # квоты Ozon считаются на каждый Client-Id
+    postings_report_create_url: str = "/v1/report/postings/create"
+    report_info_url: str = "/v1/report/info"
+    lean_postings: bool = True  # декодировать из ответа постингов только поля, нужные отчету
+    batches_fan_out: int = 8  # сколько батчей одного эндпоинта отправляется параллельно
+    report_spool_bytes: int = 16 * 1024 * 1024  # до этого размера файл отчета держится в памяти, дальше - на диске
 
     _per_endpoint_rps: Optional[Dict[str, int]] = PrivateAttr(default_factory=dict) # например: {"/v2/product/info": 5}
 
+    # колонки CSV-отчета по отправлениям -> поля постинга и товара в формате ответа списка постингов
+    REPORT_COLUMNS: ClassVar[dict[str, tuple[str, ...]]] = {
+        "posting_number": ("Номер отправления",),
+        "in_process_at": ("Принят в обработку",),
+        "status": ("Статус",),
+        "name": ("Наименование товара",),
+        "sku": ("SKU", "OZON id"),
+        "offer_id": ("Артикул",),
+        "price": ("Ваша цена",),
+        "quantity": ("Количество",),
+    }
+    REPORT_STATUSES: ClassVar[dict[str, str]] = {
+        "ожидает регистрации": StatusDelivery.AWAITING_REGISTRATION.value,
+        "идёт приёмка": StatusDelivery.ACCEPTANCE_IN_PROGRESS.value,
+        "ожидает подтверждения": StatusDelivery.AWAITING_APPROVE.value,
+        "ожидает сборки": StatusDelivery.AWAITING_PACKAGING.value,
+        "ожидает упаковки": StatusDelivery.AWAITING_PACKAGING.value,
+        "ожидает отгрузки": StatusDelivery.AWAITING_DELIVER.value,
+        "арбитраж": StatusDelivery.ARBITRATION.value,
+        "клиентский арбитраж доставки": StatusDelivery.CLIENT_ARBITRATION.value,
+        "доставляется": StatusDelivery.DELIVERING.value,
+        "у водителя": StatusDelivery.DRIVER_PICKUP.value,
+        "доставлен": StatusDelivery.DELIVERED.value,
+        "отменён": StatusDelivery.CANCELLED.value,
+        "отменен": StatusDelivery.CANCELLED.value,
+        "не принят на сортировочном центре": StatusDelivery.NOT_ACCEPTED.value,
+    }
+
     STATUS_DELIVERY: ClassVar = [
         StatusDelivery.AWAITING_REGISTRATION.value,
         StatusDelivery.ACCEPTANCE_IN_PROGRESS.value,
@@ -45,10 +91,10 @@ class OzonClient(BaseRateLimitedHttpClient):
     def model_post_init(self, __context):
         super().model_post_init(__context)
         self._per_endpoint_rps[self.analytics_url] = 1
-        # инициализируем лимитеры для каждого эндпоинта #TODO: убрать, если не нужен лимиттер для каждого эндпоинта
+        # задаем лимиты для эндпоинтов, сами лимитеры создаются на каждый Client-Id отдельно
         if self._per_endpoint_rps:
             for ep, rps in self._per_endpoint_rps.items():
-                self._limiters[ep] = RateLimiter(rps, 60.0)
+                self._limiter_specs[ep] = (rps, 60.0)
 
     async def __parse_articles(self,articles_data: dict) -> tuple:
         """
@@ -69,25 +115,60 @@ class OzonClient(BaseRateLimitedHttpClient):
     async def __build_sku_payload(self, skus: list) -> dict:
         return { "offer_id": skus, "product_id": [], "sku": [] }
 
+    async def __fetch_batch(self,
+                            endpoint: str,
+                            batch: list,
+                            headers: dict,
+                            payload_builder: Callable[[list],Awaitable[dict]]) -> list:
+        # создаем необходимое тело запроса
+        payload = await payload_builder(batch)
+        resp = await self.request("POST", endpoint, json=payload, headers=headers)
+        if resp:
+            return resp["items"]
+        return []
+
     async def __manage_batches(self,
                                endpoint: str,
                                batches: list,
                                batch_size: int,
                                headers: dict,
-                               payload_builder: Callable[[list],Awaitable[dict]]) -> list:
+                               payload_builder: Callable[[list],Awaitable[dict]],
+                               *,
+                               fan_out: Optional[int] = None,
+                               consumer: Optional[Callable[[list], Awaitable[None]]] = None) -> list:
+        """
+        Параллельно отправляет батчи (не больше fan_out одновременно) под лимитером эндпоинта.
+        Результаты отдаются в порядке входных батчей: либо списком, либо по мере готовности в consumer,
+        чтобы разбор ответа шел одновременно с ожиданием сети. С consumer возвращается пустой список.
+        """
+        sem = asyncio.Semaphore(fan_out or self.batches_fan_out)
+
+        async def fetch(batch: list) -> list:
+            async with sem:
+                return await self.__fetch_batch(endpoint, batch, headers, payload_builder)
+
+        tasks = [asyncio.create_task(fetch(batch)) for batch in chunked(batches, batch_size)]
         bodies = []
-        for batch in chunked(batches, batch_size):
-            # создаем необходимое тело запроса
-            payload = await payload_builder(batch)
-            resp = await self.request("POST", endpoint, json=payload, headers=headers)
-            if resp:
-                bodies.extend(resp["items"])
+        try:
+            for task in tasks:
+                items = await task
+                if consumer is not None:
+                    await consumer(items)
+                else:
+                    bodies.extend(items)
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            raise
         return bodies
 
-    async def __get_articles(self, *, headers: Optional[dict]=None)-> list:
-        articles = []
+    async def __iter_articles(self, *, headers: Optional[dict]=None):
+        """
+        Курсор по last_id: отдает артикулы постранично, по 1000 на страницу
+        """
+        fetched = 0
         last_id = ""
-        while len(articles) % 1000 == 0:
+        while True:
             _filter = FilterProducts()
             _data = SkusRequestShema(filter=_filter,
                                     last_id=last_id,
@@ -98,34 +179,75 @@ class OzonClient(BaseRateLimitedHttpClient):
                                       json=json,
                                       headers=headers)
             acc_articles, last_id, total = await self.__parse_articles(resp)
-            articles.extend(acc_articles)
-            if total < 1000 or len(articles) == total:
+            if acc_articles:
+                yield acc_articles
+            fetched += len(acc_articles)
+            if len(acc_articles) < 1000 or total < 1000 or fetched >= total:
                 break
-        return articles
-
-    async def get_skus(self, *, headers: Optional[dict]=None) -> list:
-        articles = await self.__get_articles(headers=headers)
-        skus = await self.__manage_batches(self.products_whole_info_url,
-                                           articles,
-                                           1000,
-                                           headers,
-                                           self.__build_sku_payload)
-        return skus
-
-    async def fetch_remainders(self, skus: list[str], headers: Optional[dict]=None):
+
+    async def __fetch_lean_info(self, batch: list, headers: dict) -> list[ProductInfoLean]:
+        # разбираем сырые байты ответа сразу в проекцию, без построения полных dict и ProductInfo
+        payload = await self.__build_sku_payload(batch)
+        resp = await self.request("POST", self.products_whole_info_url, json=payload, headers=headers, raw=True)
+        if isinstance(resp, APIError):
+            # ошибка не должна превращаться в пустой список товаров - иначе пустые остатки попадут в кэш
+            raise resp
+        return ProductsInfoLeanResponse.model_validate_json(resp).items
+
+    async def get_skus(self, *, headers: Optional[dict]=None, info_concurrency: int = 4, lean: bool = True) -> list:
+        """
+        Конвейер: каждая страница артикулов из курсора сразу уходит в запросы информации о товарах,
+        которые выполняются параллельно (не больше info_concurrency), пока курсор читает следующие страницы.
+
+        :param lean: вернуть проекции ProductInfoLean (sku, offer_id, name) вместо полных dict ответа
+        """
+        sem = asyncio.Semaphore(info_concurrency)
+
+        async def fetch_info(batch: list) -> list:
+            async with sem:
+                if lean:
+                    return await self.__fetch_lean_info(batch, headers)
+                return await self.__fetch_batch(self.products_whole_info_url,
+                                                batch,
+                                                headers,
+                                                self.__build_sku_payload)
+
+        tasks: list[asyncio.Task] = []
+        try:
+            async for articles in self.__iter_articles(headers=headers):
+                for batch in chunked(articles, 1000):
+                    tasks.append(asyncio.create_task(fetch_info(batch)))
+            # результаты в порядке страниц курсора
+            bodies = await asyncio.gather(*tasks)
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            raise
+        return [item for body in bodies for item in body]
+
+    async def fetch_remainders(self, skus: list[str],
+                               headers: Optional[dict]=None,
+                               *,
+                               fan_out: Optional[int] = None,
+                               consumer: Optional[Callable[[list], Awaitable[None]]] = None):
         bodies = await self.__manage_batches( self.remain_url,
                                               skus,
                                               100,
                                               headers,
-                                              payload_builder= self.__build_remain_payload)
+                                              payload_builder= self.__build_remain_payload,
+                                              fan_out=fan_out,
+                                              consumer=consumer)
         return bodies
 
     async def receive_analytics_data(self, analyt_body: AnalyticsRequestSchema, headers: Optional[dict]=None) \
             -> list[Datum]:
         analytics_data = []
         while True:
+            resp = await self.request("POST", self.analytics_url, json=analyt_body.to_dict(), headers=headers)
+            if isinstance(resp, APIError):
+                # ошибка запроса не должна выглядеть как пустая аналитика - иначе пустой месяц попадет в кэш
+                raise resp
             try:
-                resp = await self.request("POST", self.analytics_url, json=analyt_body.to_dict(), headers=headers)
                 parsed_resp = AnalyticsResponseSchema(**resp) if resp else None
             except (ValidationError, TypeError) as e:
                 break
@@ -142,11 +264,54 @@ class OzonClient(BaseRateLimitedHttpClient):
                 break
         return analytics_data
 
+    async def __fetch_postings_page(self, url: str,
+                                    since: str,
+                                    to: str,
+                                    limit: int,
+                                    offset: int,
+                                    headers: Optional[dict]=None,
+                                    last_changed_status_date: Optional[LastChangedStatusDate]=None) \
+            -> tuple[list, bool]:
+        """
+        :return: tuple: postings, has_next
+        """
+        filter_req = FilterPosting(since=since, to=to, last_changed_status_date=last_changed_status_date)
+        body_req = PostingRequestSchema(dir="ASC", filter=filter_req, limit=limit, offset=offset)
+        # Выполняем запрос к Ozon API
+        data = await self.request("POST", url,
+                                  json=body_req.model_dump(by_alias=True, exclude_none=True),
+                                  headers=headers,
+                                  raw=self.lean_postings)
+        if isinstance(data, APIError):
+            # ошибка не должна выглядеть как "постингов нет" - иначе пустые дни и периоды попадут в кэш
+            raise data
+        if self.lean_postings:
+            # из ответа декодируются только поля товаров для отчета
+            return await self.__parse_lean_postings(data, url, limit)
+        result = data.get("result", {})
+        # для FBO result - список постингов
+        if isinstance(result, list):
+            return result, len(result) >= limit
+        return result.get("postings", []) or [], bool(result.get("has_next"))
+
+    async def __parse_lean_postings(self, data: bytes, url: str, limit: int) -> tuple[list, bool]:
+        """
+        :return: tuple: postings (dict только с нужными полями), has_next
+        """
+        if url == self.fbo_reports_url:
+            postings = LeanFboPostingResponse.model_validate_json(data).result
+            return [p.model_dump() for p in postings], len(postings) >= limit
+        result = LeanFbsPostingResponse.model_validate_json(data).result
+        return [p.model_dump() for p in result.postings], result.has_next
+
     async def generate_reports(self, delivery_way: str,
                                since: str,
                                to: str,
                                *,
                                limit: int = 1000,
+                               prefetch: int = 1,
+                               changed_since: Optional[str] = None,
+                               changed_to: Optional[str] = None,
                                headers: Optional[dict]=None):
         """
         Получает отчет FBS с Ozon API.
@@ -155,6 +320,9 @@ class OzonClient(BaseRateLimitedHttpClient):
         :param since: Start date in ISO 8601 format (e.g., "2025-10-01T00:00:00Z").
         :param to: End date in ISO 8601 format (e.g., "2025-10-01T00:00:00Z").
         :param limit: Number of records to fetch.
+        :param prefetch: Number of offset pages kept in flight; pages are still yielded in order.
+        :param changed_since: Only postings whose status changed after this date (FBS), ISO 8601.
+        :param changed_to: Upper bound for the status change date (FBS), ISO 8601.
         :param headers: dict
         :return: JSON response from the Ozon API.
         """
@@ -162,29 +330,167 @@ class OzonClient(BaseRateLimitedHttpClient):
             url = self.fbs_reports_url
         else:
             url = self.fbo_reports_url
+        last_changed_status_date = None
+        if changed_since:
+            last_changed_status_date = LastChangedStatusDate(date_from=changed_since, to=changed_to or "")
         offset = 0
+        pending: deque[asyncio.Task] = deque()
+        try:
+            while True:
+                # держим в полете prefetch страниц вперед, лимитер все равно ограничивает частоту
+                while len(pending) < max(1, prefetch):
+                    pending.append(asyncio.create_task(
+                        self.__fetch_postings_page(url, since, to, limit, offset, headers,
+                                                   last_changed_status_date)
+                    ))
+                    offset += limit
+                postings, has_next = await pending.popleft()
+                if not postings:
+                    break
+                yield postings
+                # короткая или последняя страница - дальше данных нет
+                if not has_next:
+                    break
+        finally:
+            # отменяем лишние страницы, запрошенные наперед. Страница за последним offset могла уже
+            # завершиться ошибкой - явно забираем ее исключение, а не полагаемся на побочный эффект cancel()
+            for task in pending:
+                task.cancel()
+                task.add_done_callback(lambda t: t.cancelled() or t.exception())
+
+    async def create_postings_report(self, delivery_way: str,
+                                     since: str,
+                                     to: str,
+                                     headers: Optional[dict]=None) -> str:
+        """
+        Создает асинхронный отчет по отправлениям.
+
+        :return: код отчета для опроса статуса
+        """
+        body = PostingsReportRequestSchema(filter=PostingsReportFilter(processed_at_from=since,
+                                                                       processed_at_to=to,
+                                                                       delivery_schema=[delivery_way.lower()]))
+        resp = await self.request("POST", self.postings_report_create_url, json=body.model_dump(), headers=headers)
+        if isinstance(resp, APIError):
+            raise resp
+        return ReportCreateResponse(**resp).result.code
+
+    async def wait_report(self, code: str,
+                          headers: Optional[dict]=None,
+                          *,
+                          poll_interval: float = 5.0,
+                          timeout: float = 600.0) -> str:
+        """
+        Опрашивает статус отчета, пока он не будет готов.
+
+        :return: ссылка на файл отчета
+        """
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
         while True:
-            filter_req = FilterPosting(since=since, to=to)
-            body_req = PostingRequestSchema(dir="ASC", filter=filter_req, limit=limit, offset=offset)
-            # Выполняем запрос к Ozon API
-            data = await self.request("POST", url,
-                                      json=body_req.model_dump(by_alias=True, exclude_none=True),
-                                      headers=headers)
-            result = data.get("result", {})
+            resp = await self.request("POST", self.report_info_url, json={"code": code}, headers=headers)
+            if isinstance(resp, APIError):
+                raise resp
+            info = ReportInfoResponse(**resp).result
+            if info.status == "success" and info.file:
+                return info.file
+            if info.status == "failed":
+                raise APIError(500, self.report_info_url, f"report {code} failed: {info.error}")
+            if loop.time() >= deadline:
+                raise APIError(504, self.report_info_url, f"report {code} is not ready after {timeout}s")
+            await asyncio.sleep(poll_interval)
 
-            if delivery_way == "FBS":
-                postings = result.get("postings", []) or []
-            else:
-                postings = result
+    async def __iter_report_rows(self, file_url: str):
+        """
+        Потоково скачивает CSV-файл отчета во временный файл (в памяти до report_spool_bytes,
+        дальше на диске) и разбирает его одним csv.reader: поля в кавычках могут содержать переводы строк
+        """
+        with tempfile.SpooledTemporaryFile(max_size=self.report_spool_bytes) as raw:
+            async with self._client.stream("GET", file_url) as resp:
+                resp.raise_for_status()
+                async for chunk in resp.aiter_bytes():
+                    raw.write(chunk)
+            raw.seek(0)
+            with io.TextIOWrapper(raw, encoding="utf-8-sig", newline="") as text:
+                header = None
+                for row in csv.reader(text, delimiter=";"):
+                    if not any(cell.strip() for cell in row):
+                        continue
+                    if header is None:
+                        header = [h.strip().lstrip("\ufeff") for h in row]
+                        continue
+                    yield dict(zip(header, row))
 
-            if not postings:
-                break
-            yield postings
-            # для FBO
-            if isinstance(result, list):
-                if len(result) < limit:
-                    break
-            else:
-                if not result.get("has_next"):
-                    break
-            offset += len(postings)
+    def __report_value(self, row: dict, field: str) -> str:
+        return next((row[c] for c in self.REPORT_COLUMNS[field] if row.get(c)), "")
+
+    @staticmethod
+    def __report_datetime(value: str) -> Optional[str]:
+        """
+        Время в отчете - московское без зоны, в ответе списка постингов - UTC.
+        Незнакомый формат не прерывает выгрузку: у постинга просто не будет даты.
+        """
+        value = value.strip()
+        if not value:
+            return None
+        try:
+            moment = datetime.fromisoformat(value)
+        except ValueError:
+            try:
+                moment = datetime.strptime(value, "%d.%m.%Y %H:%M:%S")
+            except ValueError:
+                log.warning(f"незнакомый формат времени в отчете: {value!r}")
+                return None
+        if moment.tzinfo is None:
+            moment = moment.replace(tzinfo=MSK)
+        return moment.astimezone(timezone.utc).isoformat()
+
+    @staticmethod
+    def __report_price(value: str) -> str:
+        # "1 299,50": разделитель тысяч - пробел или неразрывный пробел, дробная часть - через запятую
+        for space in (" ", "\xa0", "\u202f"):
+            value = value.replace(space, "")
+        return value.replace(",", ".") or "0"
+
+    async def export_postings(self, delivery_way: str,
+                              since: str,
+                              to: str,
+                              *,
+                              limit: int = 1000,
+                              headers: Optional[dict]=None):
+        """
+        Альтернативный источник постингов: создает отчет Ozon, ждет готовности, скачивает CSV
+        и отдает постинги страницами по limit в том же формате, что и generate_reports.
+        Строки отчета идут по товарам, строки одного отправления собираются в один постинг.
+        """
+        code = await self.create_postings_report(delivery_way, since, to, headers=headers)
+        file_url = await self.wait_report(code, headers=headers)
+        page: list[dict] = []
+        posting: Optional[dict] = None
+        async for row in self.__iter_report_rows(file_url):
+            posting_number = self.__report_value(row, "posting_number")
+            if posting is None or posting["posting_number"] != posting_number:
+                if posting is not None:
+                    page.append(posting)
+                    if len(page) >= limit:
+                        yield page
+                        page = []
+                status = self.__report_value(row, "status")
+                posting = {
+                    "posting_number": posting_number,
+                    "status": self.REPORT_STATUSES.get(status.strip().lower(), status),
+                    "in_process_at": self.__report_datetime(self.__report_value(row, "in_process_at")),
+                    "products": [],
+                }
+            sku = self.__report_value(row, "sku")
+            posting["products"].append({
+                "sku": int(sku) if sku.isdigit() else 0,
+                "offer_id": self.__report_value(row, "offer_id"),
+                "name": self.__report_value(row, "name"),
+                "price": self.__report_price(self.__report_value(row, "price")),
+                "quantity": int(self.__report_value(row, "quantity") or 0),
+            })
+        if posting is not None:
+            page.append(posting)
+        if page:
+            yield page
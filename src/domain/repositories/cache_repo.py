@@ -1,12 +1,66 @@
+import asyncio
 from abc import ABC, abstractmethod
-from typing import Any
+from typing import Any, Type
+
+from pydantic import BaseModel
+
+from src.utils.cache_codec import cache_codec
 
 
 class CacheRepository(ABC):
     @abstractmethod
-    async def set(self, key: str, value: Any, ex: int | None = None) -> None:
+    async def set(self, key: str, value: Any, nx: bool | None = None, ex: int | None = None):
         pass
 
     @abstractmethod
     async def get(self, key: str):
         pass
+
+    @abstractmethod
+    async def delete(self, key: str) -> None:
+        pass
+
+    async def get_obj(self, key: str, obj_type: Type[Any]) -> Any | None:
+        """Значение по ключу, уже разобранное в obj_type"""
+        return cache_codec.decode(await self.get(key), obj_type)
+
+    async def set_obj(self, key: str, obj: BaseModel, ex: int | None = None) -> None:
+        await self.set(key, cache_codec.encode(obj), ex=ex)
+
+    async def mget(self, keys: list[str]) -> list[Any | None]:
+        """Значения пачки ключей в порядке keys, отсутствующие - None"""
+        return list(await asyncio.gather(*[self.get(key) for key in keys]))
+
+    async def mset(self, items: list[tuple[str, Any, int | None]]) -> None:
+        """Запись пачки (ключ, значение, срок жизни)"""
+        await asyncio.gather(*[self.set(key, value, ex=ex) for key, value, ex in items])
+
+    async def mget_obj(self, keys: list[str], obj_type: Type[Any]) -> list[Any | None]:
+        return [cache_codec.decode(value, obj_type) for value in await self.mget(keys)]
+
+    async def mset_obj(self, items: list[tuple[str, BaseModel, int | None]]) -> None:
+        await self.mset([(key, cache_codec.encode(obj), ex) for key, obj, ex in items])
+
+    async def hmset(self, key: str, mapping: dict[str, Any], ex: int | None = None) -> None:
+        """Запись полей хеша key. Без поддержки хешей поля хранятся отдельными ключами {key}:{поле}"""
+        await self.mset([(f"{key}:{field}", value, ex) for field, value in mapping.items()])
+
+    async def hmget(self, key: str, fields: list[str]) -> list[Any | None]:
+        """Значения полей хеша key в порядке fields, отсутствующие - None"""
+        return await self.mget([f"{key}:{field}" for field in fields])
+
+    async def acquire_lease(self, key: str, token: str, ttl: int) -> bool:
+        """Занимает ключ блокировки, если он свободен. Аренда истекает через ttl секунд"""
+        return bool(await self.set(key, token, nx=True, ex=ttl))
+
+    async def renew_lease(self, key: str, token: str, ttl: int) -> bool:
+        """Продлевает аренду, если ключ все еще принадлежит token"""
+        if await self.get(key) != token:
+            return False
+        await self.set(key, token, ex=ttl)
+        return True
+
+    async def release_lease(self, key: str, token: str) -> None:
+        """Освобождает ключ, только если он все еще принадлежит token"""
+        if await self.get(key) == token:
+            await self.delete(key)
@@ -35,10 +35,22 @@ class Item(BaseModel):
     price: float   # цена
     status: str    #"delivering", "cancelled", "delivered", "awaiting_deliver" и тд
     quantity: int  # количество
+    processed_at: Optional[datetime] = None  # дата, по которой постинг отбирался в выгрузку (FBO - создание), по ней он относится к периоду
+
+class SkuPostingsAggregate(BaseModel):
+    sku_id: int
+    article: str
+    title: str
+    price: float       # цена первой строки, как берет sum_postings_by_sku
+    min_price: float   # минимальная цена за период
+    quantity: int = 0  # количество без отмененных
+    turnover: float = 0  # сумма цена * количество по строкам без отмененных
+    statuses: dict[str, int] = Field(default_factory=dict)  # количество строк по статусам, включая отмененные
 
 class PostingsDataByDeliveryModel(BaseModel):
     model:Optional[str] = Field(default_factory=str) # acc_name_FBO или acc_name_AI_FBS
     items: Optional[list[Item]] = Field(default_factory=list)
+    aggregates: Optional[list[SkuPostingsAggregate]] = None  # заполняется при потоковой агрегации
 
 class Interval(str, Enum):
     WEEK = "Week"
@@ -1,15 +1,42 @@
-from typing import Any, Optional
+import asyncio
+import logging
+import time
+import uuid
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Optional, Type, TypeVar
 
 import redis.asyncio as aioredis
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, PrivateAttr
 
+from settings import proj_settings
 from src.domain.repositories.cache_repo import CacheRepository
+from src.infrastructure.local_cache import SqliteCache
+from src.utils.cache_codec import cache_codec
+
+log = logging.getLogger("cache")
+
+T = TypeVar("T")
+
+
+# проверка владельца и изменение ключа блокировки одной атомарной операцией
+RENEW_LEASE_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('expire', KEYS[1], ARGV[2])
+end
+return 0
+"""
+RELEASE_LEASE_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
 
 
 class Cache(BaseModel, CacheRepository):
     host: Optional[str] = Field(default="localhost")
     port: Optional[int] = Field(default=6379)
-    decode_resp: Optional[bool] = Field(default=True)
+    decode_resp: Optional[bool] = Field(default=True)  # строковые значения отдаются как str, закодированные - как bytes
     db: Optional[int] = Field(default=0) # логическая секция редис до 15 штук как листы в гугл таблице
     _cli = None
 
@@ -18,18 +45,321 @@ class Cache(BaseModel, CacheRepository):
             host=self.host,
             port=self.port,
             db=self.db,
-            decode_responses=self.decode_resp,
+            # байты нужны для сжатых значений кодека, строки декодируются в get
+            decode_responses=False,
         )
 
     async def set(self, key: str, value: Any,nx: bool | None = None, ex: int | None = None):
         return await self._cli.set(name=key, value=value,nx=nx, ex=ex)
 
+    def __decode(self, value: Any) -> Any:
+        if isinstance(value, bytes) and self.decode_resp and not cache_codec.is_encoded(value):
+            try:
+                return value.decode()
+            except UnicodeDecodeError:
+                return None
+        return value
+
     async def get(self, key: str) -> Any | None:
         try:
             value = await self._cli.get(name=key)
-            return value
+            return self.__decode(value)
+        except (aioredis.ResponseError, TypeError):
+            return None
+
+    async def mget(self, keys: list[str]) -> list[Any | None]:
+        if not keys:
+            return []
+        try:
+            values = await self._cli.mget(keys)
+        except (aioredis.ResponseError, TypeError):
+            return [None] * len(keys)
+        return [self.__decode(v) for v in values]
+
+    async def delete(self, key: str) -> None:
+        await self._cli.delete(key)
+
+    async def hmset(self, key: str, mapping: dict[str, Any], ex: int | None = None) -> None:
+        async with self._cli.pipeline(transaction=False) as pipe:
+            pipe.hset(name=key, mapping=mapping)
+            # как и SET без ex, запись без срока снимает прошлый срок жизни ключа
+            if ex is None:
+                pipe.persist(name=key)
+            else:
+                pipe.expire(name=key, time=ex)
+            await pipe.execute()
+
+    async def hmget(self, key: str, fields: list[str]) -> list[Any | None]:
+        try:
+            return await self._cli.hmget(name=key, keys=fields)
         except (aioredis.ResponseError, TypeError):
+            return [None] * len(fields)
+
+    async def renew_lease(self, key: str, token: str, ttl: int) -> bool:
+        return bool(await self._cli.eval(RENEW_LEASE_SCRIPT, 1, key, token, ttl))
+
+    async def release_lease(self, key: str, token: str) -> None:
+        await self._cli.eval(RELEASE_LEASE_SCRIPT, 1, key, token)
+
+    async def mset(self, items: list[tuple[str, Any, int | None]]) -> None:
+        """Запись пачки ключей со своим сроком жизни у каждого - один pipeline, один round-trip"""
+        if not items:
+            return
+        async with self._cli.pipeline(transaction=False) as pipe:
+            for key, value, ex in items:
+                pipe.set(name=key, value=value, ex=ex)
+            await pipe.execute()
+
+
+class LayeredCache(BaseModel, CacheRepository):
+    """
+    Двухуровневый кэш: ограниченный LRU в памяти процесса перед общим хранилищем (Redis).
+
+    Локальный уровень хранит значение в том виде, в каком оно лежит в общем хранилище,
+    и объект, разобранный из него при первом get_obj, поэтому повторное чтение ключа
+    внутри запуска не ходит в сеть и не парсит JSON. get отдает сохраненное значение без
+    перекодирования, get_obj - глубокую копию объекта: вызывающий код может ее менять,
+    не портя закэшированное. Запись идет в оба уровня, вытеснение - по числу записей,
+    суммарному размеру сериализованных значений и TTL.
+    """
+    remote: CacheRepository
+    max_entries: int = 1024  # максимум записей в локальном уровне
+    max_bytes: int = 256 * 1024 * 1024  # максимум суммарного размера значений в локальном уровне
+    local_ttl: int = 3600  # сколько секунд запись живет в локальном уровне, не дольше ex ключа
+
+    # ключ -> (значение, разобранный объект или None, время истечения, размер)
+    _entries: OrderedDict[str, tuple[Any, Any, float, int]] = PrivateAttr(default_factory=OrderedDict)
+    _size: int = PrivateAttr(default=0)
+
+    model_config = {
+        "arbitrary_types_allowed": True
+    }
+
+    def __lookup(self, key: str) -> tuple[Any, Any] | None:
+        """(значение, разобранный объект) или None, если ключа нет в локальном уровне"""
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        value, obj, expires_at, _ = entry
+        if expires_at <= time.monotonic():
+            self.__drop(key)
             return None
+        self._entries.move_to_end(key)
+        return value, obj
+
+    def __put(self, key: str, value: Any, ex: int | None = None, obj: Any = None) -> None:
+        self.__drop(key)
+        size = len(value) if isinstance(value, (str, bytes)) else 0
+        if size > self.max_bytes:
+            return
+        ttl = self.local_ttl if ex is None else min(ex, self.local_ttl)
+        self._entries[key] = (value, obj, time.monotonic() + ttl, size)
+        self._size += size
+        while len(self._entries) > self.max_entries or self._size > self.max_bytes:
+            oldest = next(iter(self._entries))
+            self.__drop(oldest)
+
+    def __drop(self, key: str) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._size -= entry[3]
+
+    def __local_obj(self, key: str, obj_type: Type[Any]) -> tuple[bool, Any | None]:
+        """(найден ли ключ в локальном уровне, копия объекта)"""
+        found = self.__lookup(key)
+        if found is None:
+            return False, None
+        value, obj = found
+        if not isinstance(obj, obj_type):
+            # разбираем значение один раз и храним объект рядом с ним до того же срока
+            obj = cache_codec.decode(value, obj_type)
+            if obj is None:
+                return True, None
+            entry = self._entries[key]
+            self._entries[key] = (entry[0], obj, entry[2], entry[3])
+        return True, obj.model_copy(deep=True)
+
+    async def set(self, key: str, value: Any, nx: bool | None = None, ex: int | None = None):
+        result = await self.remote.set(key, value, nx=nx, ex=ex)
+        if nx and not result:
+            # ключ уже занят другим процессом - локальная копия может быть устаревшей
+            self.__drop(key)
+            return result
+        self.__put(key, value, ex)
+        return result
+
+    async def get(self, key: str) -> Any | None:
+        return (await self.mget([key]))[0]
+
+    async def get_obj(self, key: str, obj_type: Type[Any]) -> Any | None:
+        return (await self.mget_obj([key], obj_type))[0]
+
+    async def set_obj(self, key: str, obj: BaseModel, ex: int | None = None) -> None:
+        await self.mset_obj([(key, obj, ex)])
+
+    async def delete(self, key: str) -> None:
+        self.__drop(key)
+        await self.remote.delete(key)
+
+    # хеши крупных значений и блокировки не кэшируются локально - они живут только в общем хранилище
+    async def hmset(self, key: str, mapping: dict[str, Any], ex: int | None = None) -> None:
+        await self.remote.hmset(key, mapping, ex=ex)
+
+    async def hmget(self, key: str, fields: list[str]) -> list[Any | None]:
+        return await self.remote.hmget(key, fields)
+
+    async def acquire_lease(self, key: str, token: str, ttl: int) -> bool:
+        return await self.remote.acquire_lease(key, token, ttl)
+
+    async def renew_lease(self, key: str, token: str, ttl: int) -> bool:
+        return await self.remote.renew_lease(key, token, ttl)
+
+    async def release_lease(self, key: str, token: str) -> None:
+        await self.remote.release_lease(key, token)
+
+    async def mget(self, keys: list[str]) -> list[Any | None]:
+        """Локальные попадания отдаются сразу, промахи - одним запросом к общему хранилищу"""
+        found, missing = {}, []
+        for key in keys:
+            local = self.__lookup(key)
+            if local is None:
+                missing.append(key)
+            else:
+                found[key] = local[0]
+        if missing:
+            for key, value in zip(missing, await self.remote.mget(missing)):
+                if value is not None:
+                    self.__put(key, value)
+                found[key] = value
+        return [found[key] for key in keys]
+
+    async def mget_obj(self, keys: list[str], obj_type: Type[Any]) -> list[Any | None]:
+        found, missing = {}, []
+        for key in keys:
+            is_local, obj = self.__local_obj(key, obj_type)
+            if is_local:
+                found[key] = obj
+            else:
+                missing.append(key)
+        if missing:
+            for key, raw in zip(missing, await self.remote.mget(missing)):
+                obj = cache_codec.decode(raw, obj_type)
+                if obj is not None:
+                    self.__put(key, raw, obj=obj)
+                    obj = obj.model_copy(deep=True)
+                found[key] = obj
+        return [found[key] for key in keys]
+
+    async def mset(self, items: list[tuple[str, Any, int | None]]) -> None:
+        await self.remote.mset(items)
+        for key, value, ex in items:
+            self.__put(key, value, ex)
+
+    async def mset_obj(self, items: list[tuple[str, BaseModel, int | None]]) -> None:
+        encoded = [(key, cache_codec.encode(obj), ex) for key, obj, ex in items]
+        await self.remote.mset(encoded)
+        # объект вызывающего кода в локальный уровень не попадает - он разберется из байтов при первом чтении
+        for key, raw, ex in encoded:
+            self.__put(key, raw, ex)
+
+    def invalidate(self, key: str | None = None) -> None:
+        """Сбрасывает локальный уровень целиком или по одному ключу"""
+        if key is None:
+            self._entries.clear()
+            self._size = 0
+        else:
+            self.__drop(key)
+
+
+class SingleFlight(BaseModel):
+    """
+    Защита от одновременного пересчета одного ключа несколькими процессами (cron и ручной запуск).
+
+    Первый процесс берет аренду ключа блокировки, считает и публикует результат,
+    остальные ждут, пока результат появится в кэше. Аренда продлевается, пока владелец жив,
+    и истекает сама, если он упал - тогда ключ забирает следующий ожидающий.
+    """
+    store: CacheRepository
+    lease: int = 60  # срок аренды блокировки, секунд
+    poll_interval: float = 1.0  # первая пауза между проверками результата
+    max_poll_interval: float = 10.0  # потолок паузы между проверками
+    wait_timeout: float = 1800.0  # сколько ждать чужой результат, дальше считаем сами
+
+    model_config = {
+        "arbitrary_types_allowed": True
+    }
+
+    async def run(self, key: str,
+                  load: Callable[[], Awaitable[T | None]],
+                  fetch: Callable[[], Awaitable[T]]) -> T:
+        """
+        :param key: ключ, по которому процессы договариваются, блокировка хранится в {key}:lock
+        :param load: чтение готового результата из кэша, None - результата нет
+        :param fetch: расчет результата, сам публикует его в кэш
+        """
+        value = await load()
+        if value is not None:
+            return value
+        lock_key = f"{key}:lock"
+        token = uuid.uuid4().hex
+        deadline = time.monotonic() + self.wait_timeout
+        interval = self.poll_interval
+        while True:
+            if await self.store.acquire_lease(lock_key, token, self.lease):
+                return await self.__run_leased(lock_key, token, load, fetch)
+            if time.monotonic() >= deadline:
+                log.warning(f"{key}: не дождались результата другого процесса, считаем сами")
+                return await fetch()
+            await asyncio.sleep(interval)
+            interval = min(interval * 2, self.max_poll_interval)
+            value = await load()
+            if value is not None:
+                return value
+
+    async def __run_leased(self, lock_key: str,
+                           token: str,
+                           load: Callable[[], Awaitable[T | None]],
+                           fetch: Callable[[], Awaitable[T]]) -> T:
+        heartbeat = asyncio.create_task(self.__keep_lease(lock_key, token))
+        try:
+            # пока ждали аренду, результат мог опубликовать прошлый владелец
+            value = await load()
+            if value is not None:
+                return value
+            return await fetch()
+        finally:
+            heartbeat.cancel()
+            await self.store.release_lease(lock_key, token)
+
+    async def __keep_lease(self, lock_key: str, token: str) -> None:
+        while True:
+            await asyncio.sleep(self.lease / 3)
+            if not await self.store.renew_lease(lock_key, token, self.lease):
+                log.warning(f"{lock_key}: аренда потеряна")
+                return
+
+
+def create_shared_cache() -> CacheRepository:
+    """Общий уровень кэша по CACHE_BACKEND: redis или локальный файл sqlite для одного узла"""
+    if proj_settings.CACHE_BACKEND == "sqlite":
+        return SqliteCache(path=proj_settings.CACHE_SQLITE_PATH,
+                           max_bytes=proj_settings.CACHE_SQLITE_MAX_MB * 1024 * 1024)
+    if proj_settings.CACHE_BACKEND == "redis":
+        # пустые REDIS_HOST/REDIS_PORT - значения по умолчанию модели Cache
+        address = {}
+        if proj_settings.REDIS_HOST:
+            address["host"] = proj_settings.REDIS_HOST
+        if proj_settings.REDIS_PORT:
+            address["port"] = int(proj_settings.REDIS_PORT)
+        return Cache(**address)
+    raise ValueError(f"неизвестный CACHE_BACKEND={proj_settings.CACHE_BACKEND!r}, ожидается redis или sqlite")
+
 
+cache = LayeredCache(remote=create_shared_cache(),
+                     max_entries=proj_settings.CACHE_LOCAL_MAX_ENTRIES,
+                     max_bytes=proj_settings.CACHE_LOCAL_MAX_MB * 1024 * 1024,
+                     local_ttl=proj_settings.CACHE_LOCAL_TTL)
 
-cache = Cache()
+single_flight = SingleFlight(store=cache,
+                             lease=proj_settings.CACHE_LOCK_LEASE,
+                             wait_timeout=proj_settings.CACHE_LOCK_WAIT)
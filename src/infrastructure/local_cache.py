@@ -0,0 +1,264 @@
+import asyncio
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Callable, Iterator, TypeVar
+
+from pydantic import BaseModel, PrivateAttr
+
+from src.domain.repositories.cache_repo import CacheRepository
+
+T = TypeVar("T")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS cache (
+    key TEXT PRIMARY KEY,
+    value BLOB NOT NULL,
+    is_text INTEGER NOT NULL,
+    expires_at REAL,
+    size INTEGER NOT NULL,
+    accessed_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS cache_accessed_at ON cache (accessed_at);
+CREATE INDEX IF NOT EXISTS cache_expires_at ON cache (expires_at);
+CREATE TABLE IF NOT EXISTS cache_hash (
+    key TEXT NOT NULL,
+    field TEXT NOT NULL,
+    value BLOB NOT NULL,
+    is_text INTEGER NOT NULL,
+    expires_at REAL,
+    size INTEGER NOT NULL,
+    accessed_at REAL NOT NULL,
+    PRIMARY KEY (key, field)
+);
+CREATE INDEX IF NOT EXISTS cache_hash_expires_at ON cache_hash (expires_at);
+"""
+
+UPSERT = """
+INSERT INTO cache (key, value, is_text, expires_at, size, accessed_at) VALUES (?, ?, ?, ?, ?, ?)
+ON CONFLICT (key) DO UPDATE SET value = excluded.value,
+                                is_text = excluded.is_text,
+                                expires_at = excluded.expires_at,
+                                size = excluded.size,
+                                accessed_at = excluded.accessed_at
+"""
+
+# как SET NX в Redis: истекший ключ считается свободным
+UPSERT_NX = UPSERT + " WHERE cache.expires_at IS NOT NULL AND cache.expires_at <= ?"
+
+UPSERT_HASH = """
+INSERT INTO cache_hash (key, field, value, is_text, expires_at, size, accessed_at) VALUES (?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT (key, field) DO UPDATE SET value = excluded.value,
+                                       is_text = excluded.is_text,
+                                       size = excluded.size,
+                                       accessed_at = excluded.accessed_at
+"""
+
+# кандидаты на вытеснение: обычные ключи и хеши целиком, давно не читанные первыми
+EVICTION_CANDIDATES = """
+SELECT 0, key, size, accessed_at FROM cache
+UNION ALL
+SELECT 1, key, SUM(size), MAX(accessed_at) FROM cache_hash GROUP BY key
+ORDER BY 4
+"""
+
+
+@contextmanager
+def transaction(conn: sqlite3.Connection) -> Iterator[None]:
+    conn.execute("BEGIN")
+    try:
+        yield
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    conn.execute("COMMIT")
+
+
+class SqliteCache(BaseModel, CacheRepository):
+    """
+    Локальный кэш в файле SQLite для одного узла и тестов, когда Redis не поднят.
+
+    Повторяет поведение Redis Cache: строки отдаются как str, байты - как bytes,
+    ex - срок жизни в секундах, nx - запись только в свободный ключ. Хеши лежат в своей таблице,
+    срок жизни у хеша общий на все поля, как у ключа Redis. Истекшие ключи не отдаются при чтении
+    и удаляются при вытеснении. Если значения в сумме больше max_bytes, удаляются давно не читанные
+    ключи, хеш - целиком. Время чтения обновляется не чаще touch_interval, поэтому чтение обычно
+    обходится без записи в базу. Запросы выполняются в потоке, чтобы не блокировать event loop.
+    """
+    path: str = ".cache/cache.sqlite3"  # файл базы
+    max_bytes: int = 1024 * 1024 * 1024  # предел суммарного размера значений
+    evict_every: int = 100  # раз в сколько записей проверять размер
+    touch_interval: float = 60.0  # время чтения ключа обновляется, только если оно старше этого, секунд
+
+    _conn: sqlite3.Connection = PrivateAttr(default=None)
+    _lock: threading.Lock = PrivateAttr(default_factory=threading.Lock)
+    _writes: int = PrivateAttr(default=0)
+
+    model_config = {
+        "arbitrary_types_allowed": True
+    }
+
+    def model_post_init(self, __context) -> None:
+        Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+
+    async def __run(self, fn: Callable[[sqlite3.Connection], T]) -> T:
+        def locked() -> T:
+            with self._lock:
+                return fn(self._conn)
+        return await asyncio.to_thread(locked)
+
+    @staticmethod
+    def __row(key: str, value: Any, ex: int | None, now: float) -> tuple:
+        # байты хранятся как есть, остальное - строкой, как это делает Redis
+        is_text = not isinstance(value, (bytes, bytearray))
+        data = str(value).encode() if is_text else bytes(value)
+        return key, data, int(is_text), None if ex is None else now + ex, len(data), now
+
+    @staticmethod
+    def __value(data: bytes, is_text: int) -> Any:
+        return data.decode() if is_text else data
+
+    async def set(self, key: str, value: Any, nx: bool | None = None, ex: int | None = None):
+        def run(conn: sqlite3.Connection) -> bool:
+            now = time.time()
+            if nx:
+                cur = conn.execute(UPSERT_NX, (*self.__row(key, value, ex, now), now))
+            else:
+                cur = conn.execute(UPSERT, self.__row(key, value, ex, now))
+            return cur.rowcount > 0
+        result = await self.__run(run)
+        await self.__maybe_evict(1)
+        return result or None
+
+    async def get(self, key: str) -> Any | None:
+        return (await self.mget([key]))[0]
+
+    async def delete(self, key: str) -> None:
+        def run(conn: sqlite3.Connection) -> None:
+            with transaction(conn):
+                conn.execute("DELETE FROM cache WHERE key = ?", (key,))
+                conn.execute("DELETE FROM cache_hash WHERE key = ?", (key,))
+        await self.__run(run)
+
+    async def mget(self, keys: list[str]) -> list[Any | None]:
+        if not keys:
+            return []
+
+        def run(conn: sqlite3.Connection) -> list[Any | None]:
+            now = time.time()
+            found, stale = {}, []
+            # не больше 500 ключей в одном IN - предел параметров SQLite
+            for i in range(0, len(keys), 500):
+                chunk = keys[i:i + 500]
+                rows = conn.execute(
+                    f"SELECT key, value, is_text, expires_at, accessed_at FROM cache "
+                    f"WHERE key IN ({','.join('?' * len(chunk))})", chunk
+                ).fetchall()
+                for key, data, is_text, expires_at, accessed_at in rows:
+                    if expires_at is None or expires_at > now:
+                        found[key] = self.__value(data, is_text)
+                        if accessed_at < now - self.touch_interval:
+                            stale.append((now, key))
+            if stale:
+                with transaction(conn):
+                    conn.executemany("UPDATE cache SET accessed_at = ? WHERE key = ?", stale)
+            return [found.get(key) for key in keys]
+        return await self.__run(run)
+
+    async def mset(self, items: list[tuple[str, Any, int | None]]) -> None:
+        if not items:
+            return
+
+        def run(conn: sqlite3.Connection) -> None:
+            now = time.time()
+            with transaction(conn):
+                conn.executemany(UPSERT, [self.__row(key, value, ex, now) for key, value, ex in items])
+        await self.__run(run)
+        await self.__maybe_evict(len(items))
+
+    async def hmset(self, key: str, mapping: dict[str, Any], ex: int | None = None) -> None:
+        if not mapping:
+            return
+
+        def run(conn: sqlite3.Connection) -> None:
+            now = time.time()
+            expires_at = None if ex is None else now + ex
+            with transaction(conn):
+                # истекший хеш не продлевается новыми полями - его старые поля удаляются
+                conn.execute("DELETE FROM cache_hash WHERE key = ? AND expires_at IS NOT NULL AND expires_at <= ?",
+                             (key, now))
+                conn.executemany(UPSERT_HASH, [(key, *self.__row(field, value, ex, now))
+                                               for field, value in mapping.items()])
+                # как HSET + EXPIRE/PERSIST: срок жизни общий на весь хеш
+                conn.execute("UPDATE cache_hash SET expires_at = ? WHERE key = ?", (expires_at, key))
+        await self.__run(run)
+        await self.__maybe_evict(len(mapping))
+
+    async def hmget(self, key: str, fields: list[str]) -> list[Any | None]:
+        if not fields:
+            return []
+
+        def run(conn: sqlite3.Connection) -> list[Any | None]:
+            now = time.time()
+            found, stale = {}, False
+            for i in range(0, len(fields), 500):
+                chunk = fields[i:i + 500]
+                rows = conn.execute(
+                    f"SELECT field, value, is_text, expires_at, accessed_at FROM cache_hash "
+                    f"WHERE key = ? AND field IN ({','.join('?' * len(chunk))})", (key, *chunk)
+                ).fetchall()
+                for field, data, is_text, expires_at, accessed_at in rows:
+                    if expires_at is None or expires_at > now:
+                        found[field] = self.__value(data, is_text)
+                        stale = stale or accessed_at < now - self.touch_interval
+            if stale:
+                # время чтения общее на хеш - вытесняется он тоже целиком
+                conn.execute("UPDATE cache_hash SET accessed_at = ? WHERE key = ?", (now, key))
+            return [found.get(field) for field in fields]
+        return await self.__run(run)
+
+    async def renew_lease(self, key: str, token: str, ttl: int) -> bool:
+        def run(conn: sqlite3.Connection) -> bool:
+            now = time.time()
+            cur = conn.execute("UPDATE cache SET expires_at = ? WHERE key = ? AND value = ? "
+                               "AND (expires_at IS NULL OR expires_at > ?)",
+                               (now + ttl, key, token.encode(), now))
+            return cur.rowcount > 0
+        return await self.__run(run)
+
+    async def release_lease(self, key: str, token: str) -> None:
+        await self.__run(lambda conn: conn.execute("DELETE FROM cache WHERE key = ? AND value = ?",
+                                                   (key, token.encode())))
+
+    async def __maybe_evict(self, writes: int) -> None:
+        self._writes += writes
+        if self._writes < self.evict_every:
+            return
+        self._writes = 0
+
+        def run(conn: sqlite3.Connection) -> None:
+            now = time.time()
+            with transaction(conn):
+                conn.execute("DELETE FROM cache WHERE expires_at IS NOT NULL AND expires_at <= ?", (now,))
+                conn.execute("DELETE FROM cache_hash WHERE expires_at IS NOT NULL AND expires_at <= ?", (now,))
+            total = conn.execute("SELECT (SELECT COALESCE(SUM(size), 0) FROM cache) "
+                                 "+ (SELECT COALESCE(SUM(size), 0) FROM cache_hash)").fetchone()[0]
+            if total <= self.max_bytes:
+                return
+            # вытесняем давно не читанные ключи и хеши целиком, пока не освободим лишнее
+            excess, victims, hash_victims = total - self.max_bytes, [], []
+            for is_hash, key, size, _ in conn.execute(EVICTION_CANDIDATES):
+                (hash_victims if is_hash else victims).append((key,))
+                excess -= size
+                if excess <= 0:
+                    break
+            with transaction(conn):
+                conn.executemany("DELETE FROM cache WHERE key = ?", victims)
+                conn.executemany("DELETE FROM cache_hash WHERE key = ?", hash_victims)
+        await self.__run(run)
@@ -66,7 +66,9 @@ async def main():
         headers=auth_onec,
         userpass=userpass,
         concurrency=100,  # количество параллельных запросов
-        default_rps=5 # 5 запросов в сек от 5 до 10 к 1С
+        default_rps=5, # стартовый лимит 5 запросов в сек, дальше подстраивается по ответам 1С
+        max_rps=10, # потолок 10 запросов в сек к 1С
+        hedge_endpoints=[prod_uid_url] # у карточек по uid длинный хвост задержек - дублируем медленные
     )
 
     # Инициализация клиента Google Sheets
@@ -93,13 +95,17 @@ async def main():
     products_url = proj_settings.OZON_PRODUCTS_URL
     products_info_url = proj_settings.OZON_PRODUCTS_INFO_URL
     analytics_url = proj_settings.OZON_ANALYTICS_URL
+    postings_report_create_url = proj_settings.OZON_POSTINGS_REPORT_CREATE_URL
+    report_info_url = proj_settings.OZON_REPORT_INFO_URL
     ozon_client = OzonClient(fbs_reports_url=fbs_reports_url,
                              fbo_reports_url=fbo_reports_url,
                              base_url=base_url,
                              remain_url=remain_url,
                              products_url=products_url,
                              products_whole_info_url=products_info_url,
-                             analytics_url=analytics_url)
+                             analytics_url=analytics_url,
+                             postings_report_create_url=postings_report_create_url,
+                             report_info_url=report_info_url)
 
     # получаем аккаунты
     client_ids = proj_settings.OZON_CLIENT_IDS.split(',')
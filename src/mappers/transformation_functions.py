@@ -1,16 +1,19 @@
+import hashlib
 import json
 from collections import namedtuple, defaultdict
-from datetime import datetime, date, timedelta
+from datetime import datetime, date, timedelta, time
+from functools import lru_cache
 from itertools import chain
 from typing import Type, Any, Literal
 from zoneinfo import ZoneInfo
 
 import dateparser
+from pydantic import BaseModel
 from transliterate import translit
 
 from src.schemas.onec_schemas import OneCProductInfo, WareHouse, OneCProductsResults, OneCArticlesResponse, \
-    OnecNomenclature, OneCNomenclatureCollection
-from src.schemas.ozon_schemas import ProductInfo, Remainder
+    OnecNomenclature, OneCNomenclatureCollection, OneCArticleInfo
+from src.schemas.ozon_schemas import ProductInfo, ProductInfoLean, Remainder, Datum
 from src.dto.dto import Item, AccountStatsRemainders, AccountStatsAnalytics, AccountStats, \
     MonthlyStats, AccountStatsPostings, CollectionStats, PostingsProductsCollection, \
     PostingsDataByDeliveryModel, RemaindersByStock, AccountSortedCommonStats, SortedCommonStats, Period, Interval, \
@@ -314,11 +317,12 @@ async def parse_obj_by_type_base_cls(obj: str | dict | None, obj_type: Type[Any]
             return obj_type(**d)
     return None
 
-async def parse_postings(postings_data: list[dict]) -> list:
+async def parse_postings(postings_data: list[dict], date_field: str = "in_process_at") -> list:
     """
     Преобразует данные о доставке в нужный формат.
 
     :param postings_data: Список данных о доставке.
+    :param date_field: поле даты, по которому постинги отбирались в выгрузку, оно попадает в Item.processed_at
     :return: Список преобразованных данных.
     """
     posting_items = []
@@ -329,6 +333,7 @@ async def parse_postings(postings_data: list[dict]) -> list:
             continue
 
         products = posting.get("products", []) or []
+        processed_at = posting.get(date_field) or posting.get("in_process_at") or posting.get("created_at")
         if products:
             # добавляем преобразованные продукты в общий список
             posting_items.extend([
@@ -338,15 +343,21 @@ async def parse_postings(postings_data: list[dict]) -> list:
                     title=prod.get("name"),
                     price=prod.get("price"),
                     status=status,
-                    quantity=prod.get("quantity")
+                    quantity=prod.get("quantity"),
+                    processed_at=processed_at
                 )
                 for prod in products if prod.get("sku")
             ])
 
     return posting_items
 
-async def parse_skus(skus_data: list[dict]) -> list:
-    parsed_skus = [ProductInfo(**s) for s in skus_data]
+async def parse_skus(skus_data: list[dict | ProductInfoLean], full_validation: bool = False) -> list:
+    """
+    :param skus_data: сырые dict ответа или уже разобранные проекции ProductInfoLean
+    :param full_validation: валидировать dict полной моделью ProductInfo
+    """
+    product_type = ProductInfo if full_validation else ProductInfoLean
+    parsed_skus = [s if isinstance(s, ProductInfoLean) else product_type(**s) for s in skus_data]
     skus = [s.sku for s in parsed_skus if s.sku != 0]
     return skus if skus else []
 
@@ -1109,6 +1120,14 @@ async def collect_onec_product_info(onec_products: OneCProductsResults, onec_art
         print(e)
     return OneCNomenclatureCollection(onec_products=nomenclatures)
 
+async def get_onec_article_fingerprint(article: OneCArticleInfo) -> str:
+    """
+    Отпечаток строки остатков 1С: если uid, артикул, остаток и сумма не изменились,
+    карточку товара по uid повторно не запрашиваем
+    """
+    raw = f"{article.uid}|{article.article}|{article.stock}|{article.summ}"
+    return hashlib.sha1(raw.encode()).hexdigest()
+
 async def rebuild_onec_pro_info_by_trading_platform(onec_prod_info: OneCProductInfo ):
     skus_only_ozon = []
     for sku in onec_prod_info.skus:
@@ -1130,6 +1149,213 @@ async def calculate_turnover_by_sku(sku: int, postings_quantity: int,  postings:
     turnover = price * postings_quantity
     return turnover if turnover is not None else 0
 
+async def get_month_key(value: str | datetime) -> str:
+    """
+    Ключ месяца вида YYYY-MM из даты периода или из id измерения "month" аналитики Ozon
+    """
+    if isinstance(value, datetime):
+        return value.strftime("%Y-%m")
+    return str(value)[:7]
+
+async def is_closed_period(period: Period, grace_days: int = 0) -> bool:
+    """
+    Период закрыт, если его конец уже в прошлом - данные за него больше не меняются.
+    grace_days - сколько дней после конца периода данные еще могут меняться (статусы постингов)
+    """
+    end_date = period.end_date
+    if isinstance(end_date, str):
+        end_date = dateparser.parse(end_date)
+    if end_date is None:
+        return False
+    if end_date.tzinfo is None:
+        end_date = end_date.replace(tzinfo=ZoneInfo("Asia/Yekaterinburg"))
+    return end_date + timedelta(days=grace_days) < datetime.now(ZoneInfo("Asia/Yekaterinburg"))
+
+async def split_period_into_windows(period: Period, days: int) -> list[tuple[datetime, datetime]]:
+    """
+    Делит период на окна по days дней. Соседние окна стыкуются границами,
+    дубликаты на стыках убираются по posting_number при сборе постингов.
+    """
+    windows = []
+    since = period.start_date
+    while since < period.end_date:
+        to = min(since + timedelta(days=days), period.end_date)
+        windows.append((since, to))
+        since = to
+    return windows or [(period.start_date, period.end_date)]
+
+async def to_filter_date(value: datetime) -> datetime:
+    """
+    Дата в той же системе отсчета, что и фильтр since/to постингов: часы периода
+    уходят в Ozon как есть с суффиксом Z, поэтому сравниваем по наивному UTC с точностью до секунды.
+    """
+    return value.replace(tzinfo=None, microsecond=0)
+
+@lru_cache
+def get_schema_hash(model: Type[BaseModel]) -> str:
+    """
+    Короткий хэш JSON-схемы модели для ключей кэша: после изменения модели
+    старые значения перестают находиться, а не падают на валидации
+    """
+    schema = json.dumps(model.model_json_schema(), sort_keys=True, ensure_ascii=False)
+    return hashlib.sha1(schema.encode()).hexdigest()[:10]
+
+async def get_period_key(period: Period) -> str:
+    """
+    Границы периода для ключа кэша вида YYYYMMDDTHHMMSS-YYYYMMDDTHHMMSS
+    """
+    bounds = []
+    for value in (period.start_date, period.end_date):
+        if isinstance(value, str):
+            value = dateparser.parse(value)
+        bounds.append(value.strftime("%Y%m%dT%H%M%S") if value else "")
+    return "-".join(bounds)
+
+def to_utc_filter_date(processed_at: str | datetime | None) -> datetime | None:
+    """
+    Дата постинга в наивном UTC - в той же системе отсчета, что и to_filter_date
+    """
+    if processed_at is None:
+        return None
+    if isinstance(processed_at, str):
+        processed_at = datetime.fromisoformat(processed_at.replace("Z", "+00:00"))
+    if processed_at.tzinfo is not None:
+        processed_at = processed_at.astimezone(ZoneInfo("UTC")).replace(tzinfo=None)
+    return processed_at
+
+async def plan_fetch_windows(periods: list[Period]) -> list[Period]:
+    """
+    Минимальный набор непересекающихся окон выгрузки, покрывающий все периоды.
+    Неделя, попадающая в месяц аналитики, скачивается один раз вместе с месяцем.
+    """
+    windows: list[list[datetime]] = []
+    for p in sorted(periods, key=lambda x: x.start_date):
+        if windows and p.start_date <= windows[-1][1]:
+            windows[-1][1] = max(windows[-1][1], p.end_date)
+        else:
+            windows.append([p.start_date, p.end_date])
+    return [Period(start_date=start, end_date=end) for start, end in windows]
+
+async def bucket_postings_by_periods(collections: list[PostingsProductsCollection],
+                                     periods: list[Period]) -> list[PostingsProductsCollection]:
+    """
+    Раскладывает постинги, скачанные окнами, по исходным периодам по дате начала обработки.
+    Постинг может попасть сразу в несколько периодов, поэтому Item копируется -
+    sum_postings_by_sku дальше меняет количество на месте.
+    """
+    fbs_items = [i for c in collections for i in c.postings_fbs.items]
+    fbo_items = [i for c in collections for i in c.postings_fbo.items]
+    fbs_model = next((c.postings_fbs.model for c in collections), "")
+    fbo_model = next((c.postings_fbo.model for c in collections), "")
+
+    bucketed = []
+    for period in periods:
+        since = await to_filter_date(period.start_date)
+        to = await to_filter_date(period.end_date)
+
+        def in_period(item: Item) -> bool:
+            processed_at = to_utc_filter_date(item.processed_at)
+            return processed_at is not None and since <= processed_at <= to
+
+        bucketed.append(PostingsProductsCollection(
+            period=period,
+            postings_fbs=PostingsDataByDeliveryModel(
+                model=fbs_model,
+                items=[i.model_copy() for i in fbs_items if in_period(i)]
+            ),
+            postings_fbo=PostingsDataByDeliveryModel(
+                model=fbo_model,
+                items=[i.model_copy() for i in fbo_items if in_period(i)]
+            ),
+        ))
+    return bucketed
+
+async def get_posting_day(processed_at: str | datetime | None) -> date | None:
+    """
+    День постинга (UTC) по дате начала обработки, по нему постинги раскладываются в дневные партиции
+    """
+    processed_at = to_utc_filter_date(processed_at)
+    return processed_at.date() if processed_at is not None else None
+
+async def get_window_days(window: Period) -> list[date]:
+    """
+    Все дни (в системе отсчета фильтра since/to), которые покрывает окно выгрузки
+    """
+    first_day = (await to_filter_date(window.start_date)).date()
+    last_day = (await to_filter_date(window.end_date)).date()
+    return [first_day + timedelta(days=i) for i in range((last_day - first_day).days + 1)]
+
+async def group_consecutive_days(days: list[date]) -> list[Period]:
+    """
+    Склеивает подряд идущие дни в периоды от 00:00:00 первого до 23:59:59 последнего дня
+    """
+    ranges: list[list[date]] = []
+    for d in sorted(days):
+        if ranges and d - ranges[-1][1] == timedelta(days=1):
+            ranges[-1][1] = d
+        else:
+            ranges.append([d, d])
+    return [Period(start_date=datetime.combine(first, time.min),
+                   end_date=datetime.combine(last, time(23, 59, 59)))
+            for first, last in ranges]
+
+async def split_postings_by_days(collection: PostingsProductsCollection,
+                                 days: list[date]) -> dict[date, PostingsProductsCollection]:
+    """
+    Раскладывает постинги выгруженного диапазона по дневным партициям.
+    Пустые дни тоже возвращаются - закрытый день без заказов сохраняется, чтобы не запрашивать его снова.
+    """
+    by_day = {
+        d: PostingsProductsCollection(
+            period=Period(start_date=datetime.combine(d, time.min),
+                          end_date=datetime.combine(d, time(23, 59, 59))),
+            postings_fbs=PostingsDataByDeliveryModel(model=collection.postings_fbs.model),
+            postings_fbo=PostingsDataByDeliveryModel(model=collection.postings_fbo.model),
+        )
+        for d in days
+    }
+    for item in collection.postings_fbs.items:
+        day = by_day.get(await get_posting_day(item.processed_at))
+        if day is not None:
+            day.postings_fbs.items.append(item)
+    for item in collection.postings_fbo.items:
+        day = by_day.get(await get_posting_day(item.processed_at))
+        if day is not None:
+            day.postings_fbo.items.append(item)
+    return by_day
+
+async def merge_postings_collections(collections: list[PostingsProductsCollection],
+                                     period: Period) -> PostingsProductsCollection:
+    return PostingsProductsCollection(
+        period=period,
+        postings_fbs=PostingsDataByDeliveryModel(
+            model=next((c.postings_fbs.model for c in collections), ""),
+            items=[i for c in collections for i in c.postings_fbs.items]
+        ),
+        postings_fbo=PostingsDataByDeliveryModel(
+            model=next((c.postings_fbo.model for c in collections), ""),
+            items=[i for c in collections for i in c.postings_fbo.items]
+        ),
+    )
+
+async def split_analytics_by_months(data: list[Datum], periods: list[Period]) -> list[MonthlyStats]:
+    """
+    Раскладывает строки аналитики, полученные одним запросом за весь диапазон
+    с dimension=["sku", "month"], обратно по месяцам периодов.
+
+    :param data: list[Datum] - строки аналитики, dimensions[0] - sku, dimensions[1] - месяц
+    :param periods: list[Period] - месячные периоды
+    :return: list[MonthlyStats] в порядке периодов
+    """
+    monthly = {await get_month_key(p.start_date): MonthlyStats(month=p.month_name) for p in periods}
+    for d in data:
+        if len(d.dimensions) < 2:
+            continue
+        stats = monthly.get(await get_month_key(d.dimensions[1].id))
+        if stats is not None:
+            stats.datum.append(d)
+    return list(monthly.values())
+
 async def get_handling_period(months: list[str] = None) -> Period | list[Period]:
     periods = []
     month_data = await get_converted_date(months)
@@ -13,10 +13,11 @@ from src.mappers.transformation_functions import collect_stats, enrich_acc_conte
     remove_archived_skus, collect_common_stats, collect_top_products_sheets_values_range, \
     get_handling_period, collect_account_auxiliary_table_values
 from src.pipeline.pipeline_steps import get_sheets_data, get_pipeline_ctx, get_account_postings, \
-    get_account_analytics_data, get_account_remainders_skus, get_onec_products
+    get_account_analytics_data, get_account_remainders_skus, get_onec_products, preload_account_caches
 from src.services.backup import BackupService
 from src.services.google_sheets import GoogleSheets
 from src.services.onec import OneCService
+from src.infrastructure.cache import cache
 
 # считаем сколько памяти занимают вычисления
 tracemalloc.start()
@@ -36,7 +37,8 @@ async def run_pipeline(*, onec: OneCClient,
                        analytics_month_names: list,
                        bucket_name: str):
 
-    onec_serv = OneCService(cli=onec)
+    # карточки 1С читаются раз за запуск и их тысячи - идут мимо локального уровня, чтобы не вытеснять кабинеты
+    onec_serv = OneCService(cli=onec, cache=cache.remote)
 
     # получаем данные из Google Sheets
     google_sheets = GoogleSheets(cli=sheets_cli)
@@ -67,6 +69,9 @@ async def run_pipeline(*, onec: OneCClient,
     period: list = [week_period]
     period.extend(month_period)
 
+    # кэш всех кабинетов одним запросом, дальше шаги читают его из памяти процесса
+    await preload_account_caches(pipeline_context, month_period)
+
     # получаем параллельно остатки и доставки с каждого кабинета
     all_postings_task = [get_account_postings(ctxt, period) for ctxt in pipeline_context]
     remainders_tasks = [get_account_remainders_skus(ctxt) for ctxt in pipeline_context]
@@ -1,18 +1,29 @@
 import asyncio
+import random
+from typing import Type
+
+from pydantic import BaseModel
+
+from settings import proj_settings
 
 from src.schemas.google_sheets_schemas import  SheetsValuesOut
 from src.clients.ozon.ozon_bound_client import OzonCliBound
 from src.clients.ozon.ozon_client import OzonClient
 from src.schemas.onec_schemas import OneCProductsResults, OneCNomenclatureCollection
 from src.schemas.ozon_schemas import SellerAccount
-from src.infrastructure.cache import cache
+from src.infrastructure.cache import cache, single_flight
 from src.dto.dto import SheetsData, AccountStatsRemainders, AccountStatsPostings, \
-    AccountStatsAnalytics, Period
-from src.mappers.transformation_functions import parse_obj_by_type_base_cls, collect_onec_product_info
+    AccountStatsAnalytics, Period, MonthlyStats, PostingsProductsCollection
+from src.mappers.transformation_functions import collect_onec_product_info, \
+    is_closed_period, plan_fetch_windows, bucket_postings_by_periods, get_schema_hash, get_period_key
 from src.pipeline.pipeline_settings import PipelineSettings, PipelineCxt
 from src.services.google_sheets import GoogleSheets
 from src.services.onec import OneCService
 from src.services.ozon import OzonService
+from src.services.postings_store import PostingsChunkStore
+from src.services.postings_sync import PostingsSyncService
+
+postings_store = PostingsChunkStore(cache=cache, shards=proj_settings.CACHE_POSTINGS_SHARDS)
 
 
 async def get_sheets_data(sheets_serv: GoogleSheets) -> SheetsData | None:
@@ -81,69 +92,179 @@ async def get_pipeline_ctx(ozon_cli: OzonClient,
 
 async def get_onec_products(onec_serv: OneCService):
     key_cache = f"common:onec-products:OneCNomenclatureCollection"
-    work_cache = await cache.get(key_cache)
-    if work_cache is not None:  # проверка на None потому что мож храниться пустая строка и 0
-        return await parse_obj_by_type_base_cls(work_cache, OneCNomenclatureCollection)
-    onec_products, onec_articles = await onec_serv.run_onec_pipeline()
-    onec_nomenclatures = await collect_onec_product_info(onec_products, onec_articles)
-    # кэшируем
-    await cache.set(key_cache, onec_nomenclatures.model_dump_json(), ex=86400)
-    return onec_nomenclatures
+
+    async def load():
+        return await cache.get_obj(key_cache, OneCNomenclatureCollection)
+
+    async def fetch():
+        onec_products, onec_articles = await onec_serv.run_onec_pipeline()
+        onec_nomenclatures = await collect_onec_product_info(onec_products, onec_articles)
+        # неполную выгрузку держим недолго: ее ждут параллельные запуски, а следующий запуск
+        # должен перезапросить упавшие uid, успешные карточки уже лежат в кэше по uid
+        await cache.set_obj(key_cache, onec_nomenclatures, ex=300 if onec_products.failures else 86400)
+        return onec_nomenclatures
+
+    # перекрывающиеся запуски не выгружают 1С одновременно - второй ждет результат первого
+    return await single_flight.run(key_cache, load, fetch)
+
+async def get_cache_key(context: PipelineCxt,
+                        kind: str,
+                        model: Type[BaseModel],
+                        period: Period | None = None) -> str:
+    """
+    Ключ кэша данных кабинета: аккаунт, вид данных, модель с хэшем ее схемы и границы периода.
+    Смена периодов в настройках или изменение модели не дает прочитать чужие данные.
+    """
+    key = f"{context.cxt_config.account_id}-acc-id:ozon-{kind}:{model.__name__}:{get_schema_hash(model)}"
+    if period is not None:
+        key += f":{await get_period_key(period)}"
+    return key
+
+def closed_period_ttl(days: int) -> int:
+    """
+    Срок хранения закрытого периода: конечный, чтобы ключи после смены схемы или настроек
+    не оставались навсегда, со случайной добавкой до 20%, чтобы периоды одной выгрузки не истекали разом
+    """
+    ttl = days * 86400
+    return ttl + random.randint(0, ttl // 5)
+
+def postings_cache_kind() -> str:
+    """
+    Вид данных постингов в ключе: источник (список или отчет) и способ агрегации
+    дают разные коллекции, поэтому хранятся под разными ключами
+    """
+    mode = "streaming" if proj_settings.OZON_POSTINGS_STREAMING_AGGREGATION else "rows"
+    return f"postings-chunks-{proj_settings.OZON_POSTINGS_SOURCE}-{mode}"
+
+async def preload_account_caches(pipeline_context: list[PipelineCxt],
+                                 analytics_periods: list[Period]) -> None:
+    """
+    Читает кэш всех кабинетов одним запросом до параллельной выгрузки: найденные значения
+    ложатся в локальный уровень кэша, и шаги get_account_* уже не ходят в Redis по отдельности.
+    Постинги хранятся шардами в хешах и читаются потоково, их здесь нет.
+    """
+    keys = []
+    for context in pipeline_context:
+        keys.append(await get_cache_key(context, "remainders", AccountStatsRemainders))
+        keys.extend([await get_cache_key(context, "analytics", MonthlyStats, p) for p in analytics_periods])
+    await cache.mget(keys)
 
 async def get_account_analytics_data(context: PipelineCxt, periods: list[Period]):
-    key_cache = f"{context.cxt_config.account_id}-acc-id:ozon-postings:AccountStatsAnalytics"
-    work_cache = await cache.get(key_cache)
-    if work_cache is not None:  # проверка на None потому что мож храниться пустая строка и 0
-        return await parse_obj_by_type_base_cls(work_cache, AccountStatsAnalytics)
-    ozon_service = OzonService(cli=context.ozon)
-    try:
-        _tasks = [asyncio.create_task(
-            ozon_service.collect_analytics_data(month_name=period.month_name,
-                                                date_since=period.start_date,
-                                                date_to=period.end_date)
-        )
-            for period in periods
-        ]
-        analytics_data= await asyncio.gather(*_tasks)
-    finally:
-        pass
+    """
+    Аналитика по месяцам. Закрытые месяцы хранятся ANALYTICS_CLOSED_MONTH_TTL_DAYS по ключу на аккаунт и месяц
+    и до истечения срока не запрашиваются, через лимитер аналитики идет только текущий открытый месяц.
+    """
+    keys = [await get_cache_key(context, "analytics", MonthlyStats, p) for p in periods]
+
+    async def load():
+        # все месяцы кабинета читаются одним запросом
+        cached = await cache.mget_obj(keys, MonthlyStats)
+        return None if any(c is None for c in cached) else cached
+
+    async def fetch():
+        cached = await cache.mget_obj(keys, MonthlyStats)
+        missing_periods = [p for p, c in zip(periods, cached) if c is None]
+        ozon_service = OzonService(cli=context.ozon)
+        # один запрос на весь диапазон недостающих месяцев, разбивка по месяцам локально
+        fetched = iter(await ozon_service.collect_analytics_by_periods(missing_periods))
+        monthly_analytics, to_store = [], []
+        for key_cache, period, month_stats in zip(keys, periods, cached):
+            if month_stats is None:
+                month_stats = next(fetched)
+                # закрытый месяц не меняется - храним долго, открытый - на сутки.
+                # пустой закрытый месяц тоже на сутки: пустой ответ мог быть сбоем, а не отсутствием продаж
+                closed = await is_closed_period(period)
+                ex = closed_period_ttl(proj_settings.ANALYTICS_CLOSED_MONTH_TTL_DAYS) \
+                    if closed and month_stats.datum else 86400
+                to_store.append((key_cache, month_stats, ex))
+            monthly_analytics.append(month_stats)
+        await cache.mset_obj(to_store)
+        return monthly_analytics
+
+    monthly_analytics = await single_flight.run(await get_cache_key(context, "analytics", MonthlyStats),
+                                                load, fetch)
     analytic_stats = AccountStatsAnalytics(ctx=context.cxt_config,
-                                           monthly_analytics=analytics_data)
-    await cache.set(key_cache, analytic_stats.model_dump_json(), ex=86400)
+                                           monthly_analytics=monthly_analytics)
     return analytic_stats
 
 async def get_account_postings(context: PipelineCxt,
                                periods: list[Period]) :
-    key_cache = (f"{context.cxt_config.account_id}"
-                 f"-acc-id:ozon-postings:AccountStatsPostings:")
-    work_cache = await cache.get(key_cache)
-    if work_cache is not None:  # проверка на None потому что мож храниться пустая строка и 0
-        return await parse_obj_by_type_base_cls(work_cache, AccountStatsPostings)
-    # делаем таски
-    _tasks = []
-    for period in periods:
-        ozon_service = OzonService(cli=context.ozon)
-        _tasks.append(ozon_service.fetch_postings(account_name=context.cxt_config.account_name,
-                                                  period=period))
-    postings = await asyncio.gather(*_tasks)
+    """
+    Постинги по периодам. Каждый период хранится под своим ключом шардами по sku (PostingsChunkStore),
+    из Ozon запрашиваются только периоды, которых нет в кэше. Период хранится сутки: его дни уже лежат
+    в дневных партициях PostingsSyncService, поэтому пересборка дешевая, а перекачка закрытых дней
+    со сменой статуса доходит до периода не позже чем через сутки. При потоковой агрегации партиций нет,
+    и период, закрытый дольше OZON_POSTINGS_MUTABLE_DAYS, хранится OZON_POSTINGS_CLOSED_DAY_TTL_DAYS.
+    """
+    kind = postings_cache_kind()
+    keys = [await get_cache_key(context, kind, PostingsProductsCollection, p) for p in periods]
+
+    async def load():
+        cached = await postings_store.read_many(keys)
+        return None if any(c is None for c in cached) else cached
+
+    async def fetch():
+        cached = await postings_store.read_many(keys)
+        missing_periods = [p for p, c in zip(periods, cached) if c is None]
+        fetched = iter(await fetch_account_postings(context, missing_periods))
+        postings = []
+        for key_cache, period, collection in zip(keys, periods, cached):
+            if collection is None:
+                collection = next(fetched)
+                settled = await is_closed_period(period, grace_days=proj_settings.OZON_POSTINGS_MUTABLE_DAYS)
+                # период пишется шардами по sku, без одной большой строки
+                long_lived = settled and proj_settings.OZON_POSTINGS_STREAMING_AGGREGATION
+                ex = closed_period_ttl(proj_settings.OZON_POSTINGS_CLOSED_DAY_TTL_DAYS) if long_lived else 86400
+                await postings_store.write(key_cache, collection, ex=ex)
+            postings.append(collection)
+        return postings
+
+    # перекрывающиеся запуски не выгружают одни и те же постинги - второй ждет результат первого
+    postings = await single_flight.run(await get_cache_key(context, kind, PostingsProductsCollection),
+                                       load, fetch)
     acc_stats_postings = AccountStatsPostings(ctx=context.cxt_config,
                                               postings=postings)
-    await cache.set(key_cache, acc_stats_postings.model_dump_json(), ex=86400)  # кэш на сутки
     return acc_stats_postings
 
+async def fetch_account_postings(context: PipelineCxt,
+                                 periods: list[Period]) -> list[PostingsProductsCollection]:
+    ozon_service = OzonService(cli=context.ozon,
+                               postings_prefetch=proj_settings.OZON_POSTINGS_PREFETCH,
+                               postings_shard_days=proj_settings.OZON_POSTINGS_SHARD_DAYS,
+                               postings_source=proj_settings.OZON_POSTINGS_SOURCE)
+    if proj_settings.OZON_POSTINGS_STREAMING_AGGREGATION:
+        # страницы сразу сворачиваются в счетчики по sku, без списков Item по строкам заказов
+        return await ozon_service.aggregate_postings_by_periods(account_name=context.cxt_config.account_name,
+                                                                periods=periods)
+    postings_sync = PostingsSyncService(ozon=ozon_service,
+                                        cache=cache,
+                                        account_id=context.cxt_config.account_id,
+                                        account_name=context.cxt_config.account_name,
+                                        mutable_days=proj_settings.OZON_POSTINGS_MUTABLE_DAYS,
+                                        closed_day_ttl=proj_settings.OZON_POSTINGS_CLOSED_DAY_TTL_DAYS * 86400)
+    # каждое окно дат синхронизируется один раз: закрытые дни из хранилища, свежие из Ozon,
+    # постинги раскладываются по периодам локально
+    windows = await plan_fetch_windows(periods)
+    synced = await postings_sync.sync_windows(windows)
+    return await bucket_postings_by_periods(synced, periods)
+
 async def get_account_remainders_skus(context: PipelineCxt):
-    key_cache = f"{context.cxt_config.account_id}-acc-id:ozon-remainders:AccountStatsRemainders"
-    work_cache = await cache.get(key_cache)
-    if work_cache is not None:
-        return await parse_obj_by_type_base_cls(work_cache, AccountStatsRemainders)
-    ozon_service = OzonService(cli=context.ozon)
-    try:
-        skus = await ozon_service.collect_skus()
-        remainders = await ozon_service.get_remainders(skus=skus)
-    finally:
-        pass
-    stats_remainders = AccountStatsRemainders(ctx=context.cxt_config,
-                                              skus=skus,
-                                              remainders=remainders)
-    await cache.set(key_cache, stats_remainders.model_dump_json(), ex=86400) # кэш на сутки
-    return stats_remainders
+    key_cache = await get_cache_key(context, "remainders", AccountStatsRemainders)
+
+    async def load():
+        return await cache.get_obj(key_cache, AccountStatsRemainders)
+
+    async def fetch():
+        ozon_service = OzonService(cli=context.ozon)
+        try:
+            skus = await ozon_service.collect_skus()
+            remainders = await ozon_service.get_remainders(skus=skus)
+        finally:
+            pass
+        stats_remainders = AccountStatsRemainders(ctx=context.cxt_config,
+                                                  skus=skus,
+                                                  remainders=remainders)
+        await cache.set_obj(key_cache, stats_remainders, ex=86400) # кэш на сутки
+        return stats_remainders
+
+    return await single_flight.run(key_cache, load, fetch)
@@ -48,8 +48,16 @@ class OneCProductByUidResponse(BaseModel):
     code: int
     data: OneCProductInfo
 
+class OneCCachedProduct(BaseModel):
+    """
+    Ответ 1С по uid вместе с отпечатком строки остатков, по которой он был получен
+    """
+    fingerprint: str
+    response: OneCProductByUidResponse
+
 class OneCProductsResults(BaseModel):
     onec_responses: list[OneCProductByUidResponse]
+    failures: dict[str, str] = Field(default_factory=dict)  # uid -> ошибка получения карточки
 
 class OnecNomenclature(BaseModel):
     article: Optional[str] = Field(default="")
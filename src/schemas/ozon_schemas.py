@@ -92,7 +92,7 @@ class LastChangedStatusDate(BaseModel):
 class FilterPosting(BaseModel):
     delivery_method_id: List[str] = Field(default_factory=list, description="List of delivery method IDs to filter by")
     is_quantum: Optional[bool] = Field(default=None, description="Whether the delivery method is quantum or not")
-    last_changed_status_date: LastChangedStatusDate = Field(default=None, description="Last changed status date")
+    last_changed_status_date: Optional[LastChangedStatusDate] = Field(default=None, description="Last changed status date")
     order_id: int = Field(default=0, description="Order ID to filter by")
     provider_id: List[str] = Field(default_factory=list, description="List of provider IDs to filter by")
     since: str = Field(default_factory=str)# ISO 8601 format, e.g. "2025-10-01T00:00:00Z" -- год-месяц-деньTчасы:минуты:секундыZ
@@ -227,6 +227,62 @@ class Result(BaseModel):
 class OzonPostingResponse(BaseModel):
     result: Result = Field(default=None, description="Result containing postings and pagination info")
 
+class LeanProduct(BaseModel):
+    """
+    Projection of Product with only the fields the report uses.
+    """
+    price: str = Field(default="0", description="Price of the product")
+    offer_id: str = Field(default="", description="Offer ID for the product")
+    name: str = Field(default="", description="Name of the product")
+    sku: int = Field(default=0, description="SKU (Stock Keeping Unit) of the product")
+    quantity: int = Field(default=0, description="Quantity of the product in the posting")
+
+class LeanPosting(BaseModel):
+    """
+    Projection of Posting: everything except products, status and dates is skipped while decoding.
+    """
+    posting_number: str = Field(default="", description="Unique identifier for the posting")
+    status: str = Field(default="", description="Current status of the posting")
+    in_process_at: Optional[str] = Field(default=None, description="Timestamp when the posting was last processed")
+    created_at: Optional[str] = Field(default=None, description="Timestamp when the posting was created")
+    products: List[LeanProduct] = Field(default_factory=list, description="List of products in the posting")
+
+class LeanResult(BaseModel):
+    postings: List[LeanPosting] = Field(default_factory=list, description="List of postings")
+    has_next: bool = Field(default=False, description="Indicates if there are more postings to fetch")
+
+class LeanFbsPostingResponse(BaseModel):
+    result: LeanResult = Field(default_factory=LeanResult, description="FBS postings and pagination info")
+
+class LeanFboPostingResponse(BaseModel):
+    result: List[LeanPosting] = Field(default_factory=list, description="FBO postings")
+
+class PostingsReportFilter(BaseModel):
+    processed_at_from: str = Field(default="", description="Start of the processing date range, ISO 8601")
+    processed_at_to: str = Field(default="", description="End of the processing date range, ISO 8601")
+    delivery_schema: List[str] = Field(default_factory=list, description="Delivery schemas: fbo, fbs, rfbs")
+    sku: List[int] = Field(default_factory=list, description="SKU filter")
+    status_alias: List[str] = Field(default_factory=list, description="Posting status filter")
+
+class PostingsReportRequestSchema(BaseModel):
+    filter: PostingsReportFilter = Field(default_factory=PostingsReportFilter, description="Report filter")
+    language: str = Field(default="DEFAULT", description="Report language")
+
+class ReportCodeResult(BaseModel):
+    code: str = Field(default="", description="Unique report ID")
+
+class ReportCreateResponse(BaseModel):
+    result: ReportCodeResult = Field(default_factory=ReportCodeResult)
+
+class ReportInfo(BaseModel):
+    code: str = Field(default="", description="Unique report ID")
+    status: str = Field(default="", description="waiting, processing, success or failed")
+    error: str = Field(default="", description="Error code if the report failed")
+    file: str = Field(default="", description="Link to the report file")
+
+class ReportInfoResponse(BaseModel):
+    result: ReportInfo = Field(default_factory=ReportInfo)
+
 class APIError(RuntimeError):
     """
     Class for handling errors from the Ozon API.
@@ -376,6 +432,17 @@ class ProductInfo(BaseModel):
     visibility_details: VisibilityDetails = Field(default_factory=VisibilityDetails)
     volume_weight: float = Field(default_factory=float)
 
+class ProductInfoLean(BaseModel):
+    """
+    Проекция ProductInfo: только поля, которые нужны пайплайну, остальное игнорируется при разборе
+    """
+    sku: int = Field(default_factory=int)
+    offer_id: str = Field(default_factory=str)
+    name: str = Field(default_factory=str)
+
+class ProductsInfoLeanResponse(BaseModel):
+    items: List[ProductInfoLean] = Field(default_factory=list)
+
 class SkusResponseShema(BaseModel):
     result: ProductInfo = Field(default_factory=Products, description="Result containing products and pagination info")
 
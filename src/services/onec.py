@@ -7,14 +7,20 @@ from typing import Optional
 from pydantic import BaseModel, Field
 
 from src.clients.onec.onec_cli import OneCClient
-from src.mappers.transformation_functions import parse_obj_by_type_base_cls
+from src.domain.repositories.cache_repo import CacheRepository
+from src.mappers.transformation_functions import parse_obj_by_type_base_cls, get_onec_article_fingerprint
 from src.schemas.onec_schemas import OneCArticlesResponse, OneCProductByUidResponse, OneCProductInfo, \
-    OneCProductsResults
+    OneCProductsResults, OneCArticleInfo, OneCCachedProduct
 
 log = logging.getLogger("OneC-service")
 
 class OneCService(BaseModel):
     cli: Optional[OneCClient] = Field(default=None)
+    cache: Optional[CacheRepository] = Field(default=None)  # кэш карточек по uid
+    product_cache_ttl: int = 7 * 86400  # привязки sku в 1С могут меняться без изменения остатков
+    workers: int = 20  # количество воркеров, параллельно запрашивающих карточки по uid
+    item_attempts: int = 2  # попыток на один uid поверх ретраев http-клиента
+    failures_log_sample: int = 5  # сколько ошибок по uid показывать в логе
 
     model_config = {
         "arbitrary_types_allowed": True
@@ -27,25 +33,90 @@ class OneCService(BaseModel):
         try:
             resp_to_stock = await self.cli.fetch_stock_prods()
             resp_articles: OneCArticlesResponse = await parse_obj_by_type_base_cls(resp_to_stock, OneCArticlesResponse)
-            uids = [u.uid for u in resp_articles.data]
             if resp_articles.done:
-                tasks_prods_by_uid = []
-                for i in range(0, len(uids), 100):
-                    batch = uids[i:i + 100]
-                    tasks = [self.cli.fetch_prod_by_uid(u) for u in batch]
-                    tasks_prods_by_uid.extend(tasks)
-                products = await asyncio.gather(*tasks_prods_by_uid)
-                result = [
-                    OneCProductByUidResponse(**art)
-                    for art in products # потому что одна задача потому и [0] объект
-                ]
-                return OneCProductsResults(onec_responses=result), resp_articles
+                # карточки по uid, у которых строка остатков не изменилась, берем из кэша
+                result, changed_articles = await self.__load_unchanged_products(resp_articles.data)
+                log.info(f"1С: из кэша {len(result)} карточек, запрашиваем {len(changed_articles)}")
+                fetched, failures = await self.__fetch_products(changed_articles)
+                if failures:
+                    sample = dict(list(failures.items())[:self.failures_log_sample])
+                    log.warning(f"1С: не удалось получить {len(failures)} карточек, например: {sample}")
+                await self.__store_products(fetched)
+                result.extend(product for _, product in fetched)
+                return OneCProductsResults(onec_responses=result, failures=failures), resp_articles
         except Exception as e:
             log.info(e)
         finally:
             await self.cli.aclose()
         return None
 
+    async def __fetch_products(self, articles: list[OneCArticleInfo]) \
+            -> tuple[list[tuple[OneCArticleInfo, OneCProductByUidResponse]], dict[str, str]]:
+        """
+        Пул воркеров с ограниченной очередью: карточки запрашиваются не больше чем workers за раз,
+        каждый uid повторяется до item_attempts раз, ошибка по одному uid не роняет весь набор.
+
+        :return: успешные пары (строка остатков, ответ) в порядке входа, ошибки по uid
+        """
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self.workers * 2)  # backpressure для продюсера
+        results: dict[int, tuple[OneCArticleInfo, OneCProductByUidResponse]] = {}
+        failures: dict[str, str] = {}
+
+        async def producer():
+            for item in enumerate(articles):
+                await queue.put(item)
+            for _ in range(self.workers):
+                await queue.put(None)  # сигнал остановки для каждого воркера
+
+        async def worker():
+            while (item := await queue.get()) is not None:
+                ind, article = item
+                for attempt in range(1, self.item_attempts + 1):
+                    try:
+                        resp = await self.cli.fetch_prod_by_uid(article.uid)
+                        results[ind] = (article, OneCProductByUidResponse(**resp))
+                        break
+                    except Exception as e:
+                        if attempt == self.item_attempts:
+                            failures[article.uid] = str(e)
+                        else:
+                            await asyncio.sleep(attempt)
+
+        await asyncio.gather(producer(), *[worker() for _ in range(self.workers)])
+        return [results[i] for i in sorted(results)], failures
+
+    def __product_key(self, uid: str) -> str:
+        return f"common:onec-product:{uid}:OneCCachedProduct"
+
+    async def __load_unchanged_products(self, articles: list[OneCArticleInfo]) \
+            -> tuple[list[OneCProductByUidResponse], list[OneCArticleInfo]]:
+        """
+        :return: закэшированные ответы по неизмененным uid, строки остатков новых или измененных uid
+        """
+        if self.cache is None:
+            return [], list(articles)
+        unchanged, changed = [], []
+        keys = [self.__product_key(article.uid) for article in articles]
+        # карточки всех uid читаются одним запросом
+        cached_products = await self.cache.mget_obj(keys, OneCCachedProduct)
+        for article, cached_product in zip(articles, cached_products):
+            if cached_product is not None:
+                if cached_product.fingerprint == await get_onec_article_fingerprint(article):
+                    unchanged.append(cached_product.response)
+                    continue
+            changed.append(article)
+        return unchanged, changed
+
+    async def __store_products(self, products: list[tuple[OneCArticleInfo, OneCProductByUidResponse]]):
+        if self.cache is None:
+            return
+        await self.cache.mset_obj([
+            (self.__product_key(article.uid),
+             OneCCachedProduct(fingerprint=await get_onec_article_fingerprint(article), response=product),
+             self.product_cache_ttl)
+            for article, product in products
+        ])
+
     def __convert_userpass_base64(self):
          token= base64.b64encode(self.cli.userpass.encode()).decode()
          return f" {token}"
@@ -1,6 +1,6 @@
 import asyncio
 import logging
-from datetime import datetime
+from datetime import datetime, date
 from typing import Optional
 
 from pydantic import BaseModel
@@ -9,13 +9,19 @@ from src.clients.ozon.ozon_bound_client import OzonCliBound
 from src.schemas.ozon_schemas import AnalyticsRequestSchema, AnalyticsMetrics, Sort, Remainder
 from src.dto.dto import PostingsProductsCollection, PostingsDataByDeliveryModel, MonthlyStats, Period
 from src.mappers import parse_postings
-from src.mappers.transformation_functions import parse_skus
+from src.services.postings_aggregation import PostingsAggregator
+from src.mappers.transformation_functions import parse_skus, split_analytics_by_months, split_period_into_windows, \
+    plan_fetch_windows, get_posting_day
 
 
 log = logging.getLogger("ozon")
 
 class OzonService(BaseModel):
     cli: Optional[OzonCliBound] = None
+    postings_prefetch: int = 1  # сколько страниц постингов запрашивать наперед
+    full_product_validation: bool = False  # полная валидация ProductInfo вместо проекции sku/offer_id/name
+    postings_source: str = "list"  # list - пагинация списков постингов, report - асинхронный отчет Ozon
+    postings_shard_days: int = 0  # длина окна в днях для параллельной выгрузки периода, 0 - без шардирования
 
     model_config = {
         "arbitrary_types_allowed": True #По умолчанию, если засунуть в модель поле с пользовательским классом
@@ -23,14 +29,36 @@ class OzonService(BaseModel):
                                         # как валидировать этот тип.
     }
 
-    async def __collect_reports(self, reports: list, gen):
+    async def __collect_reports(self, reports: list, gen, seen: Optional[set] = None, date_field: str = "in_process_at"):
         async for r in gen:
-            postings = await parse_postings(r)
+            if seen is not None:
+                # окна шардирования пересекаются на границах - отбрасываем уже полученные постинги
+                r = [p for p in r if p.get("posting_number") not in seen]
+                seen.update(p.get("posting_number") for p in r)
+            postings = await parse_postings(r, date_field=date_field)
             reports.extend(postings)
 
+    def __date_field(self, delivery_way: str) -> str:
+        """
+        Поле даты, по которому Ozon отбирает постинги в выгрузку: список FBO фильтруется по created_at,
+        список FBS и отчет - по дате принятия в обработку. По этому же полю постинг относится к периоду,
+        иначе постинги у границы окна попадают не в тот период или теряются.
+        """
+        if delivery_way == "FBO" and self.postings_source != "report":
+            return "created_at"
+        return "in_process_at"
+
+    def __postings_gen(self, delivery_way: str, since: str, to: str):
+        if self.postings_source == "report":
+            return self.cli.export_postings(delivery_way=delivery_way, since=since, to=to)
+        return self.cli.generate_reports(delivery_way=delivery_way,
+                                         since=since,
+                                         to=to,
+                                         prefetch=self.postings_prefetch)
+
     async def collect_skus(self):
-        skus_data = await self.cli.get_skus()
-        skus = await parse_skus(skus_data)
+        skus_data = await self.cli.get_skus(lean=not self.full_product_validation)
+        skus = await parse_skus(skus_data, full_validation=self.full_product_validation)
         return skus if skus else []
 
     async def fetch_postings(self, account_name: str, period: Period) \
@@ -54,42 +82,122 @@ class OzonService(BaseModel):
             model=acc_name_fbo
         )
 
+        # окна выгрузки: весь период целиком или короткие окна, которые качаются параллельно
+        if self.postings_shard_days > 0:
+            windows = await split_period_into_windows(period, self.postings_shard_days)
+        else:
+            windows = [(period.start_date, period.end_date)]
+        seen_fbs, seen_fbo = set(), set()
+
         # Получаем отчеты
-        tasks = [
-            # Получаем отчеты FBS
-            self.__collect_reports(reports=product_collection.postings_fbs.items,
-                                   gen=self.cli.generate_reports(delivery_way="FBS",
-                                                                 since=period.start_date.strftime("%Y-%m-%dT%H:%M:%SZ"),
-                                                                 to=period.end_date.strftime("%Y-%m-%dT%H:%M:%SZ"))),
-            # Получаем отчеты FBO
-            self.__collect_reports(reports=product_collection.postings_fbo.items,
-                                   gen=self.cli.generate_reports(delivery_way="FBO",
-                                                                 since=period.start_date.strftime("%Y-%m-%dT%H:%M:%SZ"),
-                                                                 to=period.end_date.strftime("%Y-%m-%dT%H:%M:%SZ"))),
-        ]
+        tasks = []
+        for since, to in windows:
+            since = since.strftime("%Y-%m-%dT%H:%M:%SZ")
+            to = to.strftime("%Y-%m-%dT%H:%M:%SZ")
+            tasks.extend([
+                # Получаем отчеты FBS
+                self.__collect_reports(reports=product_collection.postings_fbs.items,
+                                       gen=self.__postings_gen("FBS", since, to),
+                                       seen=seen_fbs if len(windows) > 1 else None,
+                                       date_field=self.__date_field("FBS")),
+                # Получаем отчеты FBO
+                self.__collect_reports(reports=product_collection.postings_fbo.items,
+                                       gen=self.__postings_gen("FBO", since, to),
+                                       seen=seen_fbo if len(windows) > 1 else None,
+                                       date_field=self.__date_field("FBO")),
+            ])
         await asyncio.gather(*tasks)
         return product_collection
 
-    async def collect_analytics_data(self,month_name: str, date_since: datetime, date_to: datetime):
+    async def __fold_reports(self, aggregator: PostingsAggregator, delivery_model: str, gen, seen: Optional[set] = None):
+        async for r in gen:
+            if seen is not None:
+                r = [p for p in r if p.get("posting_number") not in seen]
+                seen.update(p.get("posting_number") for p in r)
+            await aggregator.fold_page(delivery_model, r, date_field=self.__date_field(delivery_model))
+
+    async def aggregate_postings_by_periods(self, account_name: str, periods: list[Period]) \
+            -> list[PostingsProductsCollection]:
+        """
+        Потоковая альтернатива синхронизации по дневным партициям (PostingsSyncService): страницы постингов сразу сворачиваются
+        в счетчики по sku, списки Item по строкам заказов не строятся.
+
+        :param account_name:
+        :param periods: list[Period]
+        :return: коллекции постингов в порядке periods, по одному Item на sku
+        """
+        aggregator = PostingsAggregator(account_name=account_name, periods=periods)
+        await aggregator.prepare()
+        windows = []
+        for w in await plan_fetch_windows(periods):
+            if self.postings_shard_days > 0:
+                windows.extend(await split_period_into_windows(w, self.postings_shard_days))
+            else:
+                windows.append((w.start_date, w.end_date))
+        seen = {"FBS": set(), "FBO": set()} if len(windows) > 1 else {"FBS": None, "FBO": None}
+
+        tasks = []
+        for since, to in windows:
+            since = since.strftime("%Y-%m-%dT%H:%M:%SZ")
+            to = to.strftime("%Y-%m-%dT%H:%M:%SZ")
+            for delivery_model in ("FBS", "FBO"):
+                tasks.append(self.__fold_reports(aggregator,
+                                                 delivery_model,
+                                                 self.__postings_gen(delivery_model, since, to),
+                                                 seen[delivery_model]))
+        await asyncio.gather(*tasks)
+        return await aggregator.collections()
+
+    async def fetch_changed_posting_days(self, since: str, to: str, changed_since: str, changed_to: str) -> set[date]:
         """
-        Метод можно использовать не более 1 р в минуту
+        Дни постингов FBS из диапазона since/to, у которых статус менялся в [changed_since, changed_to].
+        FBO список не поддерживает фильтр по дате смены статуса.
         """
+        days = set()
+        async for page in self.cli.generate_reports(delivery_way="FBS",
+                                                    since=since,
+                                                    to=to,
+                                                    changed_since=changed_since,
+                                                    changed_to=changed_to):
+            for posting in page:
+                day = await get_posting_day(posting.get("in_process_at"))
+                if day is not None:
+                    days.add(day)
+        return days
+
+    async def __build_analytics_body(self, date_since: datetime, date_to: datetime) -> AnalyticsRequestSchema:
         metrics = [AnalyticsMetrics.REVENUE, AnalyticsMetrics.ORDERED_UNITS, AnalyticsMetrics.SESSION_VIEW_PDP, AnalyticsMetrics.POSITION_CATEGORY ]
         dimension = ["sku", "month"]
         sort = Sort(key=AnalyticsMetrics.REVENUE,order="DESC")
-        body = AnalyticsRequestSchema(date_from=date_since,
+        return AnalyticsRequestSchema(date_from=date_since,
                                       date_to=date_to,
                                       metrics=metrics,
                                       dimension=dimension,
                                       sort=[sort]
         )
+
+    async def collect_analytics_by_periods(self, periods: list[Period]) -> list[MonthlyStats]:
+        """
+        Планировщик аналитики: один запрос (с пагинацией) на весь диапазон месяцев вместо
+        запроса на каждый месяц. Строки разбиваются по месяцам локально по измерению "month".
+        Время стадии растет с количеством страниц, а не месяцев.
+        Эндпоинт аналитики можно вызывать не чаще 1 раза в минуту.
+        """
+        if not periods:
+            return []
+        date_since = min(p.start_date for p in periods)
+        date_to = max(p.end_date for p in periods)
+        body = await self.__build_analytics_body(date_since, date_to)
         data = await self.cli.receive_analytics_data(body)
-        return MonthlyStats(month=month_name,
-                            datum=data)
+        return await split_analytics_by_months(data, periods)
 
     async def get_remainders(self, skus: list) -> list:
         sorted_skus = list(set(skus))
-        remainders = await self.cli.fetch_remainders(sorted_skus)
-        if remainders:
-            return [Remainder(**r) for r in remainders]
-        return []
+        remainders = []
+
+        # разбираем каждый батч, пока остальные еще в сети
+        async def consume(items: list):
+            remainders.extend(Remainder(**r) for r in items)
+
+        await self.cli.fetch_remainders(sorted_skus, consumer=consume)
+        return remainders
@@ -0,0 +1,93 @@
+from datetime import datetime
+
+from pydantic import BaseModel, PrivateAttr
+
+from src.dto.dto import Period, SkuPostingsAggregate, PostingsProductsCollection, PostingsDataByDeliveryModel, Item
+from src.mappers.transformation_functions import to_filter_date, to_utc_filter_date
+
+
+class PostingsAggregator(BaseModel):
+    """
+    Потоковая агрегация постингов: каждая страница ответа Ozon сразу сворачивается
+    в счетчики по (период, модель доставки, sku) без списков Item по строкам заказов.
+    Память растет с количеством sku, а не с количеством строк.
+    """
+    account_name: str
+    periods: list[Period]
+
+    _bounds: list[tuple[datetime, datetime]] = PrivateAttr(default_factory=list)
+    _counters: list[dict[str, dict[int, SkuPostingsAggregate]]] = PrivateAttr(default_factory=list)
+
+    async def prepare(self) -> None:
+        self._bounds = [(await to_filter_date(p.start_date), await to_filter_date(p.end_date))
+                        for p in self.periods]
+        self._counters = [{"FBS": {}, "FBO": {}} for _ in self.periods]
+
+    async def fold_page(self, delivery_model: str, postings: list[dict], date_field: str = "in_process_at") -> None:
+        """
+        :param date_field: поле даты, по которому постинги отбирались в выгрузку, по нему же выбирается период
+        """
+        for posting in postings:
+            processed_at = to_utc_filter_date(posting.get(date_field)
+                                              or posting.get("in_process_at")
+                                              or posting.get("created_at"))
+            if processed_at is None:
+                continue
+            # постинг может попасть сразу в несколько периодов (неделя внутри месяца)
+            hits = [i for i, (since, to) in enumerate(self._bounds) if since <= processed_at <= to]
+            if not hits:
+                continue
+            status = posting.get("status")
+            for prod in posting.get("products", []) or []:
+                if not prod.get("sku"):
+                    continue
+                for i in hits:
+                    await self.__fold_product(self._counters[i][delivery_model], status, prod)
+
+    @staticmethod
+    async def __fold_product(counters: dict[int, SkuPostingsAggregate], status: str, prod: dict) -> None:
+        sku = prod.get("sku")
+        price = float(prod.get("price") or 0)
+        agg = counters.get(sku)
+        if agg is None:
+            agg = counters[sku] = SkuPostingsAggregate(sku_id=sku,
+                                                       article=prod.get("offer_id") or "",
+                                                       title=prod.get("name") or "",
+                                                       price=price,
+                                                       min_price=price)
+        agg.statuses[status] = agg.statuses.get(status, 0) + 1
+        # отмененные заказы не учитываются в количестве и обороте
+        if status == 'cancelled':
+            return
+        quantity = prod.get("quantity") or 0
+        if agg.quantity == 0:
+            # цена берется с первой неотмененной строки
+            agg.price = agg.min_price = price
+        agg.quantity += quantity
+        agg.turnover += price * quantity
+        agg.min_price = min(agg.min_price, price)
+
+    async def collections(self) -> list[PostingsProductsCollection]:
+        """
+        Результат в формате пайплайна: по одному Item на sku с суммарным количеством,
+        как после sum_postings_by_sku, плюс полные агрегаты.
+        """
+        result = []
+        for period, counters in zip(self.periods, self._counters):
+            by_model = {}
+            for model, aggregates in counters.items():
+                by_model[model] = PostingsDataByDeliveryModel(
+                    model=f"{self.account_name}_{model}",
+                    items=[Item(sku_id=a.sku_id,
+                                article=a.article,
+                                title=a.title,
+                                price=a.price,
+                                status=next(st for st in a.statuses if st != 'cancelled'),
+                                quantity=a.quantity)
+                           for a in aggregates.values() if a.quantity > 0],
+                    aggregates=list(aggregates.values()),
+                )
+            result.append(PostingsProductsCollection(period=period,
+                                                     postings_fbs=by_model["FBS"],
+                                                     postings_fbo=by_model["FBO"]))
+        return result
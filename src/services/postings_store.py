@@ -0,0 +1,124 @@
+import asyncio
+import logging
+from typing import AsyncIterator, Optional
+
+from pydantic import BaseModel
+
+from src.domain.repositories.cache_repo import CacheRepository
+from src.dto.dto import PostingsProductsCollection, PostingsDataByDeliveryModel
+from src.utils.cache_codec import cache_codec
+
+log = logging.getLogger("postings store")
+
+DELIVERY_MODELS = ("fbs", "fbo")
+
+
+class MissingChunkError(LookupError):
+    """Шард значения отсутствует или не читается - значение неполное"""
+
+
+class PostingsChunkStore(BaseModel):
+    """
+    Хранение постингов периода частями в хеше кэша вместо одной большой строки.
+
+    Поля хеша: meta - коллекция без строк заказов, shards - число шардов,
+    {модель}:{шард} - строки и агрегаты sku, попавших в шард (sku % shards).
+    Каждый шард кодируется и сжимается отдельно, поэтому запись и чтение не собирают
+    весь JSON периода целиком, а по списку sku читаются только нужные шарды.
+    Шарды пишутся всегда все, поэтому отсутствие любого из них значит, что значение неполное
+    (истекло по частям, вытеснено или запись прервалась) - такое значение считается промахом.
+    """
+    cache: CacheRepository
+    shards: int = 16  # на сколько шардов по sku делится каждая модель доставки
+    batch: int = 4  # сколько шардов пишется и читается за один запрос
+
+    model_config = {
+        "arbitrary_types_allowed": True
+    }
+
+    async def write(self, key: str, collection: PostingsProductsCollection, ex: int | None = None) -> None:
+        """
+        Прошлое значение удаляется целиком, затем пишутся все шарды, в том числе пустые.
+        meta пишется последней - пока ее нет, значение считается отсутствующим,
+        поэтому читатель не смешивает шарды старой и новой записи.
+        """
+        await self.cache.delete(key)
+        fields: list[tuple[str, PostingsDataByDeliveryModel]] = []
+        for model in DELIVERY_MODELS:
+            data = getattr(collection, f"postings_{model}")
+            by_shard = [PostingsDataByDeliveryModel(model=data.model,
+                                                    items=[],
+                                                    aggregates=None if data.aggregates is None else [])
+                        for _ in range(self.shards)]
+            for item in data.items:
+                by_shard[item.sku_id % self.shards].items.append(item)
+            for aggregate in data.aggregates or []:
+                by_shard[aggregate.sku_id % self.shards].aggregates.append(aggregate)
+            fields.extend((f"{model}:{shard}", chunk) for shard, chunk in enumerate(by_shard))
+
+        for i in range(0, len(fields), self.batch):
+            await self.cache.hmset(key, {field: cache_codec.encode(chunk)
+                                         for field, chunk in fields[i:i + self.batch]}, ex=ex)
+        meta = collection.model_copy(update={
+            f"postings_{model}": getattr(collection, f"postings_{model}").model_copy(update={
+                "items": [],
+                "aggregates": None if getattr(collection, f"postings_{model}").aggregates is None else [],
+            })
+            for model in DELIVERY_MODELS
+        })
+        await self.cache.hmset(key, {"shards": str(self.shards), "meta": cache_codec.encode(meta)}, ex=ex)
+
+    async def read(self, key: str, skus: Optional[set[int]] = None) -> PostingsProductsCollection | None:
+        """
+        Собирает коллекцию периода из шардов.
+
+        :param skus: если задан - читаются только шарды этих sku и только их строки
+        :return: None, если значения нет или какого-то из нужных шардов не хватает
+        """
+        meta_raw, shards_raw = await self.cache.hmget(key, ["meta", "shards"])
+        meta = cache_codec.decode(meta_raw, PostingsProductsCollection)
+        if meta is None or shards_raw is None:
+            return None
+        try:
+            async for model, chunk in self.__iter_shards(key, int(shards_raw), skus):
+                target = getattr(meta, f"postings_{model}")
+                target.items.extend(chunk.items)
+                if chunk.aggregates is not None:
+                    target.aggregates = (target.aggregates or []) + chunk.aggregates
+        except MissingChunkError as e:
+            log.warning(f"{e}, значение считается промахом")
+            return None
+        return meta
+
+    async def iter_chunks(self, key: str, skus: Optional[set[int]] = None) \
+            -> AsyncIterator[tuple[str, PostingsDataByDeliveryModel]]:
+        """
+        Потоковое чтение шардов: в памяти одновременно не больше batch шардов.
+        Отдает пары (модель доставки fbs/fbo, часть данных модели).
+
+        :raises MissingChunkError: если шарда не хватает - часть данных уже отдана, значение неполное
+        """
+        shards_raw, = await self.cache.hmget(key, ["shards"])
+        if shards_raw is None:
+            return
+        async for model, chunk in self.__iter_shards(key, int(shards_raw), skus):
+            yield model, chunk
+
+    async def read_many(self, keys: list[str]) -> list[PostingsProductsCollection | None]:
+        return list(await asyncio.gather(*[self.read(key) for key in keys]))
+
+    async def __iter_shards(self, key: str, shards: int, skus: Optional[set[int]]) \
+            -> AsyncIterator[tuple[str, PostingsDataByDeliveryModel]]:
+        wanted = range(shards) if skus is None else sorted({sku % shards for sku in skus})
+        fields = [f"{model}:{shard}" for model in DELIVERY_MODELS for shard in wanted]
+        for i in range(0, len(fields), self.batch):
+            batch = fields[i:i + self.batch]
+            for field, raw in zip(batch, await self.cache.hmget(key, batch)):
+                chunk = cache_codec.decode(raw, PostingsDataByDeliveryModel)
+                if chunk is None:
+                    raise MissingChunkError(f"{key}: нет шарда {field}")
+                if skus is not None:
+                    chunk.items = [item for item in chunk.items if item.sku_id in skus]
+                    if chunk.aggregates is not None:
+                        chunk.aggregates = [a for a in chunk.aggregates if a.sku_id in skus]
+                yield field.split(":")[0], chunk
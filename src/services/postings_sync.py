@@ -0,0 +1,136 @@
+import asyncio
+import logging
+import random
+from datetime import datetime, date, timedelta, timezone
+
+from pydantic import BaseModel
+
+from src.domain.repositories.cache_repo import CacheRepository
+from src.dto.dto import PostingsProductsCollection, Period
+from src.mappers.transformation_functions import get_window_days, get_schema_hash, \
+    group_consecutive_days, split_postings_by_days, merge_postings_collections
+from src.services.ozon import OzonService
+
+log = logging.getLogger("postings sync")
+
+
+class PostingsSyncService(BaseModel):
+    """
+    Инкрементальная синхронизация постингов кабинета по дневным партициям.
+
+    Закрытые дни (старше mutable_days) хранятся closed_day_ttl и до истечения срока не скачиваются.
+    Свежие дни, где статусы еще меняются, запрашиваются каждый запуск.
+    Водяной знак хранится на каждый закрытый день - время, когда день последний раз скачан
+    или проверен: закрытые дни FBS, в которых с того момента сменился статус постинга,
+    скачиваются заново. Знак дня сдвигается только когда сам день проверен, поэтому
+    дни вне окон текущего запуска проверятся от своего знака, когда снова попадут в окно.
+
+    Список FBO не фильтруется по дате смены статуса, поэтому поздние изменения FBO
+    подхватываются только при повторной выгрузке дня после истечения closed_day_ttl.
+    Сроки разнесены случайной добавкой, чтобы дни одной выгрузки не истекали разом.
+    """
+    ozon: OzonService
+    cache: CacheRepository
+    account_id: str
+    account_name: str
+    mutable_days: int = 14  # сколько последних дней статусы постингов считаются изменяемыми
+    closed_day_ttl: int = 30 * 86400  # срок хранения закрытого дня, после него день перепроверяется целиком (и FBO)
+    empty_day_ttl: int = 86400  # пустой закрытый день храним недолго - пустая выгрузка могла быть сбоем
+
+    model_config = {
+        "arbitrary_types_allowed": True
+    }
+
+    def __day_key(self, day: date) -> str:
+        # дни из списков и из отчета различаются набором полей - храним их раздельно
+        return (f"{self.account_id}-acc-id:ozon-postings:day:{self.ozon.postings_source}:"
+                f"{get_schema_hash(PostingsProductsCollection)}:{day.isoformat()}")
+
+    def __watermarks_key(self) -> str:
+        # хеш день -> время последней проверки дня
+        return (f"{self.account_id}-acc-id:ozon-postings:watermarks:{self.ozon.postings_source}:"
+                f"{get_schema_hash(PostingsProductsCollection)}")
+
+    async def __changed_closed_days(self, watermarks: dict[date, str], sync_started: str) -> set[date]:
+        """
+        Закрытые дни, в которых статус постинга сменился после водяного знака дня.
+        Дни с одинаковым знаком проверяются одним запросом по их диапазону.
+        """
+        by_watermark: dict[str, list[date]] = {}
+        for day, watermark in watermarks.items():
+            by_watermark.setdefault(watermark, []).append(day)
+
+        async def check(watermark: str, days: list[date]) -> set[date]:
+            changed = await self.ozon.fetch_changed_posting_days(since=f"{min(days)}T00:00:00Z",
+                                                                 to=f"{max(days)}T23:59:59Z",
+                                                                 changed_since=watermark,
+                                                                 changed_to=sync_started)
+            return changed & set(days)
+
+        checked = await asyncio.gather(*[check(w, days) for w, days in by_watermark.items()])
+        return set().union(*checked)
+
+    async def __closed_day_ttl(self, day_collection: PostingsProductsCollection) -> int:
+        if not day_collection.postings_fbs.items and not day_collection.postings_fbo.items:
+            return self.empty_day_ttl
+        return self.closed_day_ttl + random.randint(0, self.closed_day_ttl // 5)
+
+    async def sync_windows(self, windows: list[Period]) -> list[PostingsProductsCollection]:
+        """
+        Постинги окон выгрузки: закрытые дни из хранилища, остальные - из Ozon.
+        Возвращает постинги целых дней, покрывающих окно, отсечение по границам окна делает бакетирование.
+        Водяные знаки сдвигаются только для дней, проверенных или скачанных в этом окне.
+        """
+        now = datetime.now(timezone.utc)
+        sync_started = now.strftime("%Y-%m-%dT%H:%M:%SZ")
+        closed_before = now.date() - timedelta(days=self.mutable_days)
+        collections = await asyncio.gather(*[
+            self.__sync_window(w, closed_before, sync_started) for w in windows
+        ])
+        return list(collections)
+
+    async def __sync_window(self, window: Period,
+                            closed_before: date,
+                            sync_started: str) -> PostingsProductsCollection:
+        days = await get_window_days(window)
+        closed_days = [d for d in days if d < closed_before]
+        # закрытые дни окна и их водяные знаки читаются двумя запросами
+        stored = await self.cache.mget_obj([self.__day_key(d) for d in closed_days], PostingsProductsCollection)
+        raw_watermarks = await self.cache.hmget(self.__watermarks_key(), [d.isoformat() for d in closed_days])
+        # день без знака (знаки истекли раньше дня) считается непроверенным и скачивается заново
+        watermarks = {}
+        for day, collection, watermark in zip(closed_days, stored, raw_watermarks):
+            if collection is not None and watermark is not None:
+                watermarks[day] = watermark.decode() if isinstance(watermark, bytes) else watermark
+        dirty_days = await self.__changed_closed_days(watermarks, sync_started)
+
+        collections = []
+        days_to_fetch = []
+        stored_by_day = {d: c for d, c in zip(closed_days, stored) if d in watermarks and d not in dirty_days}
+        for day in days:
+            if day in stored_by_day:
+                collections.append(stored_by_day[day])
+                continue
+            days_to_fetch.append(day)
+
+        ranges = await group_consecutive_days(days_to_fetch)
+        fetched = await asyncio.gather(*[
+            self.ozon.fetch_postings(account_name=self.account_name, period=r) for r in ranges
+        ])
+        to_store = []
+        for r, collection in zip(ranges, fetched):
+            by_day = await split_postings_by_days(collection, await get_window_days(r))
+            for day, day_collection in by_day.items():
+                if day < closed_before:
+                    to_store.append((self.__day_key(day), day_collection, await self.__closed_day_ttl(day_collection)))
+            collections.extend(by_day.values())
+        await self.cache.mset_obj(to_store)
+        # каждый закрытый день окна либо проверен, либо скачан заново - сдвигаем знаки только им
+        if closed_days:
+            # знаки живут не меньше самого долгого срока дня
+            await self.cache.hmset(self.__watermarks_key(), {day.isoformat(): sync_started for day in closed_days},
+                                   ex=self.closed_day_ttl + self.closed_day_ttl // 5)
+
+        log.info(f"{self.account_name}: дней из хранилища {len(days) - len(days_to_fetch)}, "
+                 f"скачано {len(days_to_fetch)}")
+        return await merge_postings_collections(collections, window)
@@ -0,0 +1,81 @@
+import logging
+import zlib
+from typing import Any, Literal, Type
+
+from pydantic import BaseModel, ValidationError
+
+from settings import proj_settings
+
+try:
+    import zstandard
+except ImportError:  # zstd не обязателен - без него значения сжимаются zlib
+    zstandard = None
+
+log = logging.getLogger("cache codec")
+
+# заголовок значения: магия, версия формата, способ сжатия
+MAGIC = b"\xc0\x7e"
+FORMAT_VERSION = 1
+COMPRESSIONS = {"none": 0, "zlib": 1, "zstd": 2}
+DECODE_ERRORS = (ValidationError, ValueError, zlib.error) + ((zstandard.ZstdError,) if zstandard else ())
+
+
+class CacheCodec(BaseModel):
+    """
+    Сериализация pydantic-моделей для кэша: JSON от pydantic, сжатие zstd (или zlib)
+    и заголовок с версией формата и способом сжатия.
+
+    Чтение идет через model_validate_json без промежуточного dict. Значения без заголовка
+    (старые JSON-строки) читаются как есть, значения с неизвестной версией считаются промахом.
+    """
+    compression: Literal["none", "zlib", "zstd"] = "zstd"
+    level: int = 3  # уровень сжатия
+    min_size: int = 1024  # значения меньше этого размера не сжимаются
+
+    def model_post_init(self, __context) -> None:
+        if self.compression == "zstd" and zstandard is None:
+            log.warning("zstandard не установлен, кэш сжимается zlib")
+            self.compression = "zlib"
+
+    @staticmethod
+    def is_encoded(value: bytes | str) -> bool:
+        return isinstance(value, bytes) and value[:len(MAGIC)] == MAGIC
+
+    def encode(self, obj: BaseModel) -> bytes:
+        payload = obj.model_dump_json().encode()
+        compression = self.compression if len(payload) >= self.min_size else "none"
+        if compression == "zstd":
+            payload = zstandard.ZstdCompressor(level=self.level).compress(payload)
+        elif compression == "zlib":
+            payload = zlib.compress(payload, self.level)
+        return MAGIC + bytes((FORMAT_VERSION, COMPRESSIONS[compression])) + payload
+
+    def decode(self, value: bytes | str | None, obj_type: Type[BaseModel]) -> Any | None:
+        """
+        :return: объект obj_type или None, если значения нет, формат незнаком
+                 или оно не проходит валидацию текущей схемой
+        """
+        if value is None:
+            return None
+        try:
+            if not self.is_encoded(value):
+                return obj_type.model_validate_json(value)
+            version, compression = value[len(MAGIC)], value[len(MAGIC) + 1]
+            if version != FORMAT_VERSION:
+                return None
+            payload = value[len(MAGIC) + 2:]
+            if compression == COMPRESSIONS["zstd"]:
+                if zstandard is None:
+                    return None
+                payload = zstandard.ZstdDecompressor().decompress(payload)
+            elif compression == COMPRESSIONS["zlib"]:
+                payload = zlib.decompress(payload)
+            elif compression != COMPRESSIONS["none"]:
+                return None
+            return obj_type.model_validate_json(payload)
+        except DECODE_ERRORS as e:
+            log.warning(f"значение кэша для {obj_type.__name__} не прочитано: {e}")
+            return None
+
+
+cache_codec = CacheCodec(compression=proj_settings.CACHE_COMPRESSION)
@@ -1,77 +1,219 @@
 import asyncio
+import random
+import time
+from collections import deque
 from typing import Optional, Any
 
 import httpx
 from pydantic import BaseModel, PrivateAttr
-from tenacity import AsyncRetrying, wait_exponential_jitter, stop_after_attempt, retry_if_exception_type
 
 from src.schemas.ozon_schemas import APIError
-from src.utils.limiter import RateLimiter, parse_retry_after_seconds
+from src.utils.limiter import RateLimiter, AdaptiveRateLimiter, FairSemaphore, parse_retry_after_seconds
 
 
 class BaseRateLimitedHttpClient(BaseModel):
-    concurrency: int = 45  # количество параллельных запросов
-    default_rps: int = 45  # дефолтный лимит
+    concurrency: int = 45  # количество параллельных запросов на один раздел (аккаунт)
+    default_rps: int = 45  # дефолтный (стартовый при adaptive_rate) лимит
+    adaptive_rate: bool = True  # AIMD-регулировка лимита по ответам сервера
+    max_rps: int = 100  # потолок для адаптивного лимита эндпоинтов без собственного лимита
+    max_attempts: int = 3  # количество попыток на запрос
+    max_connections: int = 100  # общее количество соединений на все разделы
+    hedge_endpoints: list[str] = []  # эндпоинты, для которых разрешены дубли медленных запросов
+    hedge_percentile: float = 0.95  # перцентиль задержки, после которого отправляется дубль
+    hedge_min_samples: int = 20  # сколько ответов нужно набрать, прежде чем дублировать
+    partition_header: Optional[str] = None  # заголовок, по которому квоты делятся на разделы, например Client-Id
     base_url: str
 
-    _sem: asyncio.Semaphore = PrivateAttr(default=None)  # семафор для ограничения параллельных запросов
-    _limiters: dict[str, RateLimiter] = PrivateAttr(default_factory=dict)  # словарь лимитеров для каждого эндпоинта
+    _sems: dict[str, asyncio.Semaphore] = PrivateAttr(default_factory=dict)  # семафоры по разделам
+    _fair_sem: FairSemaphore = PrivateAttr(default=None)  # общий семафор с round-robin между разделами
+    _limiters: dict[tuple[str, str], RateLimiter] = PrivateAttr(default_factory=dict)  # лимитеры по (раздел, эндпоинт)
+    _limiter_specs: dict[str, tuple[int, float]] = PrivateAttr(default_factory=dict)  # эндпоинт -> (rate, period)
+    _latencies: dict[str, deque[float]] = PrivateAttr(default_factory=dict)  # задержки успешных ответов за запуск
     _client: httpx.AsyncClient = PrivateAttr(default=None)
     _timeout: float = PrivateAttr(default=None)  # таймаут для запросов
-    _default_limiter: RateLimiter = PrivateAttr(default=None)  # лимитер по умолчанию для всех эндпоинтов
 
     def model_post_init(self, __context):
-        self._sem = asyncio.Semaphore(self.concurrency)
+        self._fair_sem = FairSemaphore(self.max_connections)
         self._client = httpx.AsyncClient(
             base_url=self.base_url,
             timeout=self._timeout,
-            limits=httpx.Limits(max_keepalive_connections=100, max_connections=100)
+            limits=httpx.Limits(max_keepalive_connections=self.max_connections,
+                                max_connections=self.max_connections)
         )
-        self._default_limiter = RateLimiter(self.default_rps, 1.0)
 
-    async def _limiter_for(self, endpoint: str) -> RateLimiter:
-        # ищем точное совпадение или префикс
-        return self._limiters.get(endpoint, self._default_limiter)
+    def _partition_for(self, headers: Optional[dict]) -> str:
+        if self.partition_header and headers:
+            return str(headers.get(self.partition_header, ""))
+        return ""
+
+    def _sem_for(self, partition: str) -> asyncio.Semaphore:
+        sem = self._sems.get(partition)
+        if sem is None:
+            sem = self._sems[partition] = asyncio.Semaphore(self.concurrency)
+        return sem
+
+    async def _limiter_for(self, endpoint: str, partition: str = "") -> RateLimiter:
+        # эндпоинты без собственного лимита делят дефолтный лимитер раздела
+        ep = endpoint if endpoint in self._limiter_specs else ""
+        limiter = self._limiters.get((partition, ep))
+        if limiter is None:
+            rate, period = self._limiter_specs.get(ep, (self.default_rps, 1.0))
+            if self.adaptive_rate:
+                # собственный лимит эндпоинта - это потолок из документации, выше не поднимаем
+                max_rate = rate if ep else max(rate, self.max_rps)
+                limiter = AdaptiveRateLimiter(rate, period, max_rate=max_rate)
+            else:
+                limiter = RateLimiter(rate, period)
+            self._limiters[(partition, ep)] = limiter
+        return limiter
+
+    def effective_rps(self, endpoint: str, partition: str = "") -> float:
+        """Текущий действующий лимит эндпоинта в запросах в секунду"""
+        ep = endpoint if endpoint in self._limiter_specs else ""
+        limiter = self._limiters.get((partition, ep))
+        if limiter is None:
+            # лимитер еще не создан - действует стартовый лимит
+            rate, period = self._limiter_specs.get(ep, (self.default_rps, 1.0))
+            return rate / period
+        return limiter.rate / limiter.period
+
+    @staticmethod
+    def _feedback(limiter: RateLimiter, endpoint: str, status_code: int, latency: float) -> None:
+        if not isinstance(limiter, AdaptiveRateLimiter):
+            return
+        if 200 <= status_code < 300:
+            limiter.on_success(latency, endpoint)
+        elif status_code == 429 or 500 <= status_code < 600:
+            limiter.on_throttle()
 
     async def aclose(self):
         await self._client.aclose()
 
-    async def request(self, method: str, endpoint: str, *, json: Optional[dict] = None, headers: Optional[dict]=None) \
-            -> Any:
-        limiter = await self._limiter_for(endpoint) # получаем лимитер для данного эндпоинта #TODO: убрать, если не нужно
-        if limiter:
-            await limiter.acquire()
-        # если лимитер не задан, используем дефолтный
-        else:
-            await self._default_limiter.acquire()
-        await self._sem.acquire()
+    async def _send(self, method: str,
+                    endpoint: str,
+                    partition: str,
+                    limiter: RateLimiter,
+                    *,
+                    json: Optional[dict] = None,
+                    headers: Optional[dict] = None) -> httpx.Response:
+        """Один HTTP-вызов под семафором раздела и общим пулом соединений"""
+        sem = self._sem_for(partition)
+        await sem.acquire()
+        try:
+            # общий пул соединений выдается разделам по очереди
+            await self._fair_sem.acquire(partition)
+        except BaseException:
+            sem.release()
+            raise
+        try:
+            started = time.monotonic()
+            resp = await self._client.request(method, endpoint, json=json, headers=headers)
+            latency = time.monotonic() - started
+            self._feedback(limiter, endpoint, resp.status_code, latency)
+            if 200 <= resp.status_code < 300:
+                self._latencies.setdefault(endpoint, deque(maxlen=500)).append(latency)
+            return resp
+        finally:
+            self._fair_sem.release()
+            sem.release()
+
+    def _hedge_delay(self, endpoint: str) -> Optional[float]:
+        """Задержка до дубля - перцентиль задержек эндпоинта за текущий запуск"""
+        samples = self._latencies.get(endpoint)
+        if not samples or len(samples) < self.hedge_min_samples:
+            return None
+        ordered = sorted(samples)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * self.hedge_percentile))]
+
+    async def _send_hedged(self, method: str,
+                           endpoint: str,
+                           partition: str,
+                           limiter: RateLimiter,
+                           *,
+                           json: Optional[dict] = None,
+                           headers: Optional[dict] = None) -> httpx.Response:
+        """
+        Если ответ не пришел за перцентиль задержки, отправляет один дубль и берет первый ответ 2xx.
+        Дубль проходит через тот же лимитер и расходует его бюджет. Если ни один ответ не 2xx,
+        возвращается первый полученный, чтобы его статус обработал request().
+        """
+        delay = self._hedge_delay(endpoint)
+        primary = asyncio.create_task(self._send(method, endpoint, partition, limiter, json=json, headers=headers))
+        if delay is None:
+            return await primary
+        tasks = {primary}
         try:
-            async for attempt in AsyncRetrying(
-                wait=wait_exponential_jitter(initial=0.5, max=8.0),
-                stop=stop_after_attempt(3),
-                retry=retry_if_exception_type((httpx.TransportError, APIError)),
-                reraise=True,
-            ):
-                with attempt:
-                    resp = await self._client.request(method, endpoint, json=json, headers=headers)
-                    # 2xx — ок
+            done, tasks = await asyncio.wait(tasks, timeout=delay)
+            if done:
+                return primary.result()
+            await limiter.acquire()
+            tasks.add(asyncio.create_task(self._send(method, endpoint, partition, limiter, json=json, headers=headers)))
+            fallback: Optional[httpx.Response] = None
+            error: Optional[BaseException] = None
+            while tasks:
+                done, tasks = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is not None:
+                        error = error or task.exception()
+                        continue
+                    resp = task.result()
                     if 200 <= resp.status_code < 300:
-                        return resp.json()
-                    # 429 — подчиняемся Retry-After и бросаем ретраибл
-                    if resp.status_code == 429:
-                        delay = parse_retry_after_seconds(resp.headers, default=30.5)
-                        await asyncio.sleep(delay)
-                        raise APIError(resp.status_code, endpoint, resp.text)
-                    if resp.status_code == 400:
-                        # 400 — ошибка авторизации, не ретраим
-                        return  APIError(resp.status_code, endpoint, resp.text)
-                    if resp.status_code == 401:
-                        # 401 — ошибка авторизации, не ретраим
-                        return APIError(resp.status_code, endpoint, resp.text)
-                    # 5xx — ретраим с экспонентой
-                    if 500 <= resp.status_code < 600 or (resp.status_code == 400):
-                        raise APIError(resp.status_code, endpoint, resp.text)
-                    # 4xx (кроме 429) — логическая ошибка, не ретраим
-                    raise APIError(resp.status_code, endpoint, resp.text)
+                        return resp
+                    fallback = fallback or resp
+            if fallback is not None:
+                return fallback
+            raise error
         finally:
-            self._sem.release()
+            for task in tasks:
+                task.cancel()
+
+    async def request(self, method: str,
+                      endpoint: str,
+                      *,
+                      json: Optional[dict] = None,
+                      headers: Optional[dict]=None,
+                      raw: bool = False) -> Any:
+        """
+        :param raw: вернуть тело успешного ответа байтами без json-декодирования
+        """
+        partition = self._partition_for(headers)
+        limiter = await self._limiter_for(endpoint, partition) # получаем лимитер раздела для данного эндпоинта
+        attempt = 0
+        while True:
+            attempt += 1
+            # каждая попытка, в том числе повторная, заново проходит через лимитер
+            await limiter.acquire()
+            try:
+                send = self._send_hedged if endpoint in self.hedge_endpoints else self._send
+                resp = await send(method, endpoint, partition, limiter, json=json, headers=headers)
+            except httpx.TransportError:
+                if attempt >= self.max_attempts:
+                    raise
+                await asyncio.sleep(self._backoff(attempt))
+                continue
+            # 2xx — ок
+            if 200 <= resp.status_code < 300:
+                return resp.content if raw else resp.json()
+            if resp.status_code == 400:
+                # 400 — ошибка авторизации, не ретраим
+                return  APIError(resp.status_code, endpoint, resp.text)
+            if resp.status_code == 401:
+                # 401 — ошибка авторизации, не ретраим
+                return APIError(resp.status_code, endpoint, resp.text)
+            # 429 — подчиняемся Retry-After, 5xx — ретраим с экспонентой
+            if resp.status_code == 429:
+                delay = parse_retry_after_seconds(resp.headers, default=30.5)
+            elif 500 <= resp.status_code < 600:
+                delay = self._backoff(attempt)
+            else:
+                # 4xx (кроме 429) — логическая ошибка, не ретраим
+                raise APIError(resp.status_code, endpoint, resp.text)
+            if attempt >= self.max_attempts:
+                raise APIError(resp.status_code, endpoint, resp.text)
+            # ждем вне семафоров, слоты достаются здоровым запросам
+            await asyncio.sleep(delay)
+
+    @staticmethod
+    def _backoff(attempt: int) -> float:
+        # экспонента с джиттером: 0.5, 1, 2 ... но не больше 8 сек
+        return min(8.0, 0.5 * 2 ** (attempt - 1)) + random.uniform(0, 1)
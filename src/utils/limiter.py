@@ -52,4 +52,128 @@ class RateLimiter:
             self._hits.append(time.monotonic())
         await asyncio.sleep(max(0.0, sleep_for)) # ждем, пока не освободится слот
 
+
+class AdaptiveRateLimiter(RateLimiter):
+    """
+    Лимитер с AIMD-регулировкой: rate растет аддитивно, пока ответы успешные,
+    и снижается мультипликативно на 429, 5xx и устойчивом росте задержки.
+
+    Задержка отслеживается отдельно по каждому эндпоинту (key): лимитер раздела общий
+    для эндпоинтов с очень разным временем ответа. Всплеском считается p95 окна
+    из latency_window ответов, превышающий базовый p95 эндпоинта в latency_spike раз,
+    одиночные медленные ответы из длинного хвоста rate не снижают.
+    """
+    def __init__(self, rate: float,
+                 period: float = 1.0,
+                 *,
+                 min_rate: float = 1.0,
+                 max_rate: Optional[float] = None,
+                 increase: float = 1.0,
+                 decrease: float = 0.5,
+                 latency_spike: float = 3.0,
+                 latency_window: int = 50):
+        super().__init__(rate, period)
+        self.min_rate = min(min_rate, rate)
+        self.max_rate = max_rate if max_rate is not None else rate
+        self.increase = increase  # на сколько поднимаем rate за окно успешных ответов
+        self.decrease = decrease  # во сколько раз снижаем rate при перегрузке
+        self.latency_spike = latency_spike  # во сколько раз p95 окна выше базового считается всплеском
+        self.latency_window = latency_window  # сколько ответов эндпоинта в одном окне оценки задержки
+        self._successes = 0
+        self._latencies: Dict[str, list[float]] = {}  # текущее окно задержек по эндпоинтам
+        self._baseline_p95: Dict[str, float] = {}  # базовый p95 задержки по эндпоинтам
+        self._last_decrease = 0.0
+
+    def _is_latency_spike(self, latency: float, key: str) -> bool:
+        window = self._latencies.setdefault(key, [])
+        window.append(latency)
+        if len(window) < self.latency_window:
+            return False
+        # окно заполнено - оцениваем его целиком и начинаем следующее
+        ordered = sorted(window)
+        window.clear()
+        p95 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+        baseline = self._baseline_p95.get(key)
+        if baseline is None:
+            self._baseline_p95[key] = p95
+            return False
+        if p95 > self.latency_spike * baseline:
+            # базу не сдвигаем, пока задержка не вернется к норме
+            return True
+        self._baseline_p95[key] = 0.8 * baseline + 0.2 * p95
+        return False
+
+    def on_success(self, latency: float, key: str = "") -> None:
+        if self._is_latency_spike(latency, key):
+            self.on_throttle()
+            return
+        self._successes += 1
+        # окно успешных ответов равно текущему rate - прирост не быстрее одного шага за период
+        if self._successes >= self.rate:
+            self._successes = 0
+            self.rate = min(self.max_rate, self.rate + self.increase)
+
+    def on_throttle(self) -> None:
+        now = time.monotonic()
+        # не чаще одного снижения за период, чтобы пачка параллельных 429 не обрушила rate
+        if now - self._last_decrease < self.period:
+            return
+        self._last_decrease = now
+        self._successes = 0
+        self.rate = max(self.min_rate, self.rate * self.decrease)
+
+
+class FairSemaphore:
+    """
+    Семафор, который выдает освободившиеся слоты по очереди (round-robin) между разделами,
+    например аккаунтами. Длинная пагинация одного кабинета не вытесняет запросы других.
+    """
+    def __init__(self, value: int):
+        self._value = value
+        self._waiters: dict[str, deque[asyncio.Future]] = {}  # ожидающие по разделам
+        self._order: deque[str] = deque()  # очередь разделов, у которых есть ожидающие
+
+    async def acquire(self, partition: str = "") -> None:
+        if self._value > 0 and not self._order:
+            self._value -= 1
+            return
+        fut = asyncio.get_running_loop().create_future()
+        waiters = self._waiters.setdefault(partition, deque())
+        if not waiters:
+            self._order.append(partition)
+        waiters.append(fut)
+        try:
+            await fut
+        except asyncio.CancelledError:
+            if fut.done() and not fut.cancelled():
+                # слот уже был выдан - возвращаем его следующему
+                self.release()
+            else:
+                self.__discard(partition, fut)
+            raise
+
+    def release(self) -> None:
+        while self._order:
+            partition = self._order.popleft()
+            waiters = self._waiters[partition]
+            fut = waiters.popleft()
+            # раздел уходит в конец очереди, если у него еще есть ожидающие
+            if waiters:
+                self._order.append(partition)
+            else:
+                del self._waiters[partition]
+            if not fut.done():
+                fut.set_result(None)
+                return
+        self._value += 1
+
+    def __discard(self, partition: str, fut: asyncio.Future) -> None:
+        waiters = self._waiters.get(partition)
+        if waiters is None or fut not in waiters:
+            return
+        waiters.remove(fut)
+        if not waiters:
+            del self._waiters[partition]
+            self._order.remove(partition)
+
 # --------- доменные сущности ---------
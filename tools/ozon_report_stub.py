@@ -0,0 +1,122 @@
+"""
+Заглушка асинхронного отчета Ozon по отправлениям для локальной проверки OZON_POSTINGS_SOURCE=report.
+
+Отдает эндпоинты создания и статуса отчета и сам CSV-файл. В файле есть то, на чем ломается разбор:
+BOM, поле в кавычках с переводом строки, цена с неразрывным пробелом в разрядах,
+московское время и несколько строк товаров одного отправления.
+
+Запуск заглушки (адрес указать в OZON_BASE_URL):
+    python -m tools.ozon_report_stub --port 8081
+Проверка OzonClient.export_postings против заглушки:
+    python -m tools.ozon_report_stub --check
+"""
+import argparse
+import asyncio
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+REPORT_CODE = "stub-report"
+REPORT_CSV = (
+    "﻿Номер отправления;Принят в обработку;Статус;Наименование товара;OZON id;Артикул;Ваша цена;Количество\n"
+    "0001-1;2025-08-19 02:30:00;Доставлен;Чайник;1001;kettle;1 299,50;1\n"
+    "0001-1;2025-08-19 02:30:00;Доставлен;\"Кружка\n(две строки)\";1002;mug;350;2\n"
+    "\n"
+    "0002-1;19.08.2025 23:10:00;Отменён;Ложка;1003;spoon;\"1 000\";3\n"
+).encode()
+
+# то, что должен отдать export_postings по REPORT_CSV
+EXPECTED_POSTINGS = [
+    {
+        "posting_number": "0001-1",
+        "status": "delivered",
+        "in_process_at": "2025-08-18T23:30:00+00:00",
+        "products": [
+            {"sku": 1001, "offer_id": "kettle", "name": "Чайник", "price": "1299.50", "quantity": 1},
+            {"sku": 1002, "offer_id": "mug", "name": "Кружка\n(две строки)", "price": "350", "quantity": 2},
+        ],
+    },
+    {
+        "posting_number": "0002-1",
+        "status": "cancelled",
+        "in_process_at": "2025-08-19T20:10:00+00:00",
+        "products": [
+            {"sku": 1003, "offer_id": "spoon", "name": "Ложка", "price": "1000", "quantity": 3},
+        ],
+    },
+]
+
+
+class ReportStubHandler(BaseHTTPRequestHandler):
+    def _send(self, status: int, body: bytes, content_type: str) -> None:
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_json(self, payload: dict) -> None:
+        self._send(200, json.dumps(payload).encode(), "application/json")
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        if self.path == "/v1/report/postings/create":
+            self._send_json({"result": {"code": REPORT_CODE}})
+        elif self.path == "/v1/report/info":
+            host, port = self.server.server_address[:2]
+            self._send_json({"result": {"code": REPORT_CODE,
+                                        "status": "success",
+                                        "file": f"http://{host}:{port}/report.csv"}})
+        else:
+            self._send(404, b"{}", "application/json")
+
+    def do_GET(self):
+        if self.path == "/report.csv":
+            self._send(200, REPORT_CSV, "text/csv; charset=utf-8")
+        else:
+            self._send(404, b"", "text/plain")
+
+    def log_message(self, format, *args):
+        pass
+
+
+async def check(base_url: str) -> None:
+    from src.clients.ozon.ozon_client import OzonClient
+
+    client = OzonClient(base_url=base_url,
+                        fbs_reports_url="/v3/posting/fbs/list",
+                        fbo_reports_url="/v2/posting/fbo/list",
+                        remain_url="",
+                        products_url="",
+                        products_whole_info_url="",
+                        analytics_url="")
+    try:
+        postings = []
+        async for page in client.export_postings("FBS", "2025-08-19T00:00:00Z", "2025-08-20T00:00:00Z", limit=1):
+            postings.extend(page)
+    finally:
+        await client.aclose()
+    assert postings == EXPECTED_POSTINGS, json.dumps(postings, ensure_ascii=False, indent=2)
+    print(f"ok: {len(postings)} постинга из отчета совпали с ожидаемыми")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--check", action="store_true", help="поднять заглушку на свободном порту и проверить клиент")
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0 if args.check else args.port), ReportStubHandler)
+    if not args.check:
+        print(f"заглушка отчета Ozon: http://127.0.0.1:{server.server_address[1]}")
+        server.serve_forever()
+        return
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        asyncio.run(check(f"http://127.0.0.1:{server.server_address[1]}"))
+    finally:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()